@@ -1,12 +1,27 @@
 import os
 import json
-import uuid
+import hashlib
+import time
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, request, jsonify
 from flask_cors import CORS
 import re 
-from db_utils import save_prescription_to_db, get_prescriptions
+from db_utils import (
+    save_prescription_to_db, get_prescriptions, ensure_indexes,
+    save_medicine_file, get_medicine_file, get_latest_medicine_file
+)
+from extraction_cache import ExtractionCache, image_sha256, cache_key
+from shorthand import normalize_medicine
+from drug_names import default_index
+from metrics import Counter, Histogram
+from json_stream import ItemStreamParser
+from image_derivatives import (
+    make_model_input, make_thumbnail, store_derivatives, open_image_variant, MODEL_INPUT_MAX_SIDE
+)
 
 # Optional Gemini
 load_dotenv()
@@ -19,14 +34,29 @@ try:
 except Exception:
     USE_GEMINI = False
 
+# Uploads up to this size are parsed into memory; larger ones roll over to an anonymous
+# temporary file in UPLOAD_DIR, which the OS removes when it is closed (or the worker dies)
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+class UploadRequest(Request):
+    """Multipart files go to a spooled buffer instead of werkzeug's fixed 500 KB memory limit."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, dir=UPLOAD_DIR)
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 
-# Persistent storage for JSON outputs
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-os.makedirs(DATA_DIR, exist_ok=True)
+# Indexes back the single-round-trip upserts in db_utils
+try:
+    ensure_indexes()
+except Exception as e:
+    print(f"⚠️ Could not ensure MongoDB indexes: {e}")
 
-# Temporary dir for uploads
+# Spool dir for large uploads (images themselves are kept in GridFS)
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -55,25 +85,42 @@ def default_dates(days=7):
     end = (tz_today + timedelta(days=days-1)).strftime("%Y-%m-%d")
     return start, end
 
+def drug_name_index():
+    """The local formulary index (see drug_names.py), or None when none is built."""
+    try:
+        return default_index()
+    except Exception as e:
+        print(f"⚠️ Drug name index unavailable: {e}")
+        return None
+
 def to_target_schema(items):
     out = {"medicines": []}
+    drug_index = drug_name_index()
     for it in items:
         name = it.get("name", "").strip()
         times = [normalize_time(x) for x in it.get("time", []) if str(x).strip()]
         start_date = it.get("start_date")
         end_date = it.get("end_date")
         notes = it.get("notes", "").strip()
+        # Expand dosing shorthand (bdpc, qhs, ...) into notes and time slots, locally
+        name, notes, times = normalize_medicine(name, notes, times)
         if not start_date or not end_date:
             s, e = default_dates()
             start_date = start_date or s
             end_date = end_date or e
-        out["medicines"].append({
+        medicine = {
             "name": name or "Unknown",
             "time": times or ["08:00"],
             "start_date": start_date,
             "end_date": end_date,
             "notes": notes
-        })
+        }
+        # Closest formulary names, when the extracted one is not an exact match
+        if drug_index is not None and name:
+            matches = drug_index.match(name, k=3)
+            if matches and matches[0][1] < 1.0:
+                medicine["name_candidates"] = [{"name": n, "score": score} for n, score in matches]
+        out["medicines"].append(medicine)
     return out
 
 # ---------- Gemini path ----------
@@ -99,132 +146,542 @@ Rules:
 - Output ONLY JSON. No commentary.
 """
 
-def extract_with_gemini(image_path):
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_SAFETY_SETTINGS = {
+    "HARASSMENT": "block_none",
+    "HATE_SPEECH": "block_none",
+    "SEXUAL": "block_none",
+    "DANGEROUS": "block_none"
+}
 
-    import os
+# Bumps automatically whenever the prompt, model or model-input resolution changes,
+# invalidating cached extractions
+PROMPT_VERSION = hashlib.sha256(
+    f"{GEMINI_MODEL}|{MODEL_INPUT_MAX_SIDE}|{GEMINI_SYSTEM_PROMPT}".encode("utf-8")
+).hexdigest()[:12]
+
+extraction_cache = ExtractionCache()
+
+# Thumbnails and model-input copies are rendered in the background, off the request path
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+derivative_executor = ThreadPoolExecutor(max_workers=DERIVATIVE_WORKERS, thread_name_prefix="derivatives")
+
+# ---------- Metrics (exposed on /metrics) ----------
+UPLOAD_STAGE_SECONDS = Histogram("upload_stage_seconds", "Time spent in each upload pipeline stage", ["stage"])
+UPLOAD_ERRORS = Counter("upload_errors_total", "Upload pipeline failures by stage", ["stage"])
+MODEL_TOKENS = Counter("model_tokens_total", "Tokens reported by the model's usage metadata", ["kind"])
+EXTRACTION_CACHE = Counter("extraction_cache_total", "Extraction cache lookups by outcome", ["outcome"])
+FIRST_MEDICINE_SECONDS = Histogram("stream_first_medicine_seconds",
+                                   "Streaming uploads: time from request to the first medicine event")
+
+@contextmanager
+def stage(name):
+    """Time one pipeline stage; an exception escaping it counts as an error of that stage."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPLOAD_ERRORS.inc(stage=name)
+        raise
+    finally:
+        UPLOAD_STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+def record_usage(resp):
+    """Add the response's usage metadata (actual token counts) to model_tokens_total."""
+    usage = getattr(resp, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, field in (("prompt", "prompt_token_count"), ("candidates", "candidates_token_count"),
+                        ("total", "total_token_count")):
+        count = getattr(usage, field, None)
+        if count:
+            MODEL_TOKENS.inc(count, kind=kind)
+
+def model_contents(img_bytes, mime_type):
+    return [
+        {"text": GEMINI_SYSTEM_PROMPT.strip()},
+        {"inline_data": {"mime_type": mime_type, "data": img_bytes}}
+    ]
+
+def extract_items_with_gemini(img_bytes, mime_type="image/jpeg"):
+    """Run the model on raw image bytes and return the parsed (un-normalized) medicine items."""
+    model = genai.GenerativeModel(GEMINI_MODEL)
+
+    with stage("model_call"):
+        resp = model.generate_content(model_contents(img_bytes, mime_type), safety_settings=GEMINI_SAFETY_SETTINGS)
+    record_usage(resp)
+
+    with stage("json_parse"):
+        txt = resp.text.strip()
+        m = re.search(r'\{[\s\S]*\}', txt)
+        if not m:
+            raise ValueError("Gemini did not return JSON.")
+        data = json.loads(m.group(0))
+    if isinstance(data, dict):
+        items = data.get("medicines") or data.get("data") or []
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = []
+    return items
 
-    image_size_kb = os.path.getsize(image_path) / 1024
-    image_tokens_estimate = int(image_size_kb)  # 1 KB ≈ 1 token
-    def estimate_tokens(text: str) -> int:
-        return max(1, len(text) // 4)
+def stream_items_with_gemini(img_bytes, mime_type="image/jpeg"):
+    """
+    Streaming variant of extract_items_with_gemini: yields each raw medicine item
+    as soon as the model's streamed answer completes it.
+    """
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    started = time.perf_counter()
+    try:
+        resp = model.generate_content(model_contents(img_bytes, mime_type), safety_settings=GEMINI_SAFETY_SETTINGS,
+                                      stream=True)
+        parser = ItemStreamParser()
+        for chunk in resp:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. the final finish-reason chunk)
+                continue
+            yield from parser.feed(text)
+        parser.close()
+    except Exception:
+        UPLOAD_ERRORS.inc(stage="model_call")
+        raise
+    finally:
+        UPLOAD_STAGE_SECONDS.observe(time.perf_counter() - started, stage="model_call")
+    # Usage metadata is complete once the stream has been consumed
+    record_usage(resp)
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
+def extract_with_gemini(image_path):
     with open(image_path, "rb") as f:
         img_bytes = f.read()
+    model_bytes, mime_type = make_model_input(img_bytes)
+    return to_target_schema(extract_items_with_gemini(model_bytes, mime_type))
 
-    resp = model.generate_content(
-        [
-            {"text": GEMINI_SYSTEM_PROMPT.strip()},
-            {"inline_data": {"mime_type": "image/jpeg", "data": img_bytes}}
-        ],
-        safety_settings={
-            "HARASSMENT": "block_none",
-            "HATE_SPEECH": "block_none",
-            "SEXUAL": "block_none",
-            "DANGEROUS": "block_none"
-        }
-    )
-
-
+def cached_items(key):
+    """Raw items cached under key, or None (also when the cache is unavailable)."""
     try:
-        def estimate_tokens(text: str) -> int:
-            return max(1, len(text) // 4)
-
-        prompt_tokens = estimate_tokens(GEMINI_SYSTEM_PROMPT)
-        print("Approx input tokens:", prompt_tokens+ image_tokens_estimate)
-
+        items = extraction_cache.get(key)
+    except Exception as e:
+        print(f"Extraction cache read failed: {e}")
+        items = None
+    EXTRACTION_CACHE.inc(outcome="miss" if items is None else "hit")
+    return items
 
+def cache_items(key, items):
+    try:
+        extraction_cache.put(key, items)
     except Exception as e:
-        prompt_tokens = "Error calculating tokens: " + str(e)
-
-    print("Input tokens:", prompt_tokens)
-    output_tokens = estimate_tokens(resp.text)
-    print("Approx total output tokens:", output_tokens)
-    import re
-    txt = resp.text.strip()
-    m = re.search(r'\{[\s\S]*\}', txt)
-    if not m:
-        raise ValueError("Gemini did not return JSON.")
-    data = json.loads(m.group(0))
-    if isinstance(data, dict):
-        items = data.get("medicines") or data.get("data") or []
-    elif isinstance(data, list):
-        items = data
-    else:
-        items = []
-    return to_target_schema(items)
+        print(f"Extraction cache write failed: {e}")
 
 # ---------- API ----------
 
-UPLOAD_DIR = "uploads"
-DATA_DIR = "data"
+def extract_upload(image_bytes, image_hash=None):
+    """
+    Model stage for one image, behind the content-addressed extraction cache.
+    - image_hash: SHA-256 of the original upload, if the caller has it (the cache key)
+    Returns (data, "hit" | "miss", model_bytes, model_mime). The image is only decoded
+    and downscaled on a miss; on a hit model_bytes is None and the "model" derivative
+    is left to be rendered lazily. Raw items are cached rather than the normalized
+    output so default dates are still computed relative to today on a hit.
+    """
+    key = cache_key(image_hash or image_sha256(image_bytes), PROMPT_VERSION)
+    items = cached_items(key)
+    if items is not None:
+        return to_target_schema(items), "hit", None, None
+
+    # Downscale once; the same bytes go to the model and into GridFS as the "model" derivative
+    with stage("model_input"):
+        model_bytes, model_mime = make_model_input(image_bytes)
+    items = extract_items_with_gemini(model_bytes, model_mime)
+    cache_items(key, items)
+    return to_target_schema(items), "miss", model_bytes, model_mime
+
+def save_medicine_json(email, data):
+    """Store the extracted JSON in the medicine_files collection. Returns the generated filename."""
+    with stage("medicine_file_write"):
+        return save_medicine_file(email, data)
+
+def render_derivatives(file_id, image_bytes, model_bytes, model_mime):
+    # Derivatives sit next to the original in GridFS; failures fall back to lazy generation
+    try:
+        with stage("derivatives"):
+            derivatives = {"thumb": make_thumbnail(image_bytes)}
+            if model_bytes is not None:
+                derivatives["model"] = (model_bytes, model_mime)
+            store_derivatives(file_id, derivatives)
+    except Exception as e:
+        print(f"Derivative generation failed, will render lazily: {e}")
 
+def save_derivatives(entry, image_bytes, model_bytes=None, model_mime=None):
+    """Render and store the image's derivatives in the background, off the request path."""
+    derivative_executor.submit(render_derivatives, entry["image_file_id"], image_bytes, model_bytes, model_mime)
 
-@app.route("/api/prescriptions", methods=["POST"])
-def upload_and_extract():
-    print(request.files)
-    if "file" not in request.files:
-        return jsonify({"error": "No file part 'file' found"}), 400
-    print(request.form)
-    f = request.files["file"]
-    email = request.form.get("string") 
+def process_upload(email, image_bytes, image_name):
+    """
+    Extraction pipeline for one uploaded image: model (or cache) -> medicines JSON -> prescription.
+    Shared by the synchronous endpoint and async jobs. Returns the response payload.
+    image_bytes is the one in-memory copy of the upload; the hasher, the model
+    input and GridFS all read that same object.
+    """
+    image_hash = image_sha256(image_bytes)
+    data, cache_status, model_bytes, model_mime = extract_upload(image_bytes, image_hash)
+    out_filename = save_upload(email, data, image_bytes, image_name, image_hash, model_bytes, model_mime)
+    return {"ok": True, "data": data, "file": out_filename, "cache": cache_status}
+
+def save_upload(email, data, image_bytes, image_name, image_hash, model_bytes, model_mime):
+    """Store the medicines JSON, the prescription entry with its image, and the derivatives. Returns the filename."""
+    out_filename = save_medicine_json(email, data)
+
+    # Save prescription + image in MongoDB
+    from db_utils import save_prescription  # make sure this imports your function
+    with stage("mongo_write"):
+        entry = save_prescription(
+            email=email,
+            data=data,
+            filename=out_filename,
+            image_bytes=image_bytes,
+            image_name=image_name,
+            sha256=image_hash
+        )
+    save_derivatives(entry, image_bytes, model_bytes, model_mime)
+    return out_filename
 
+def check_upload(f, email):
+    """Validation shared by the single-upload endpoints; returns an error response or None."""
+    if f is None:
+        return jsonify({"error": "No file part 'file' found"}), 400
     if not email:
         return jsonify({"error": "Email is required"}), 400
     if f.filename == "":
         return jsonify({"error": "Empty filename"}), 400
-
     ext = os.path.splitext(f.filename)[1].lower()
     if ext not in [".jpg", ".jpeg", ".png"]:
         return jsonify({"error": "Only .jpg, .jpeg, .png supported"}), 400
+    if not USE_GEMINI:
+        return jsonify({"error": "Gemini API not configured"}), 500
+    return None
 
-    save_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{ext}")
-    f.save(save_path)
+
+@app.route("/api/prescriptions", methods=["POST"])
+def upload_and_extract():
+    """
+    Upload a prescription image and extract its medicines.
+    With ?async=1 (or form field async=1) the request returns 202 and a job id
+    immediately; poll GET /api/jobs/<id> or stream GET /api/jobs/<id>/events.
+    """
+    print(request.files)
+    print(request.form)
+    f = request.files.get("file")
+    email = request.form.get("string")
+    error = check_upload(f, email)
+    if error:
+        return error
 
     try:
-        if USE_GEMINI:
-            data = extract_with_gemini(save_path)
-        else:
-            return jsonify({"error": "Gemini API not configured"}), 500
+        # Read once from the parsed (in-memory or spooled) stream; nothing else touches disk
+        with stage("multipart_save"):
+            image_bytes = f.read()
+        f.close()
+
+        run_async = (request.args.get("async") or request.form.get("async") or "").lower() in ("1", "true", "yes")
+        if run_async:
+            try:
+                job_id = job_queue.submit(process_upload, email, image_bytes, f.filename)
+            except QueueFull as e:
+                return jsonify({"ok": False, "error": str(e)}), 503
+            return jsonify({
+                "ok": True,
+                "job_id": job_id,
+                "status": "pending",
+                "status_url": url_for("get_job", job_id=job_id),
+                "events_url": url_for("stream_job_events", job_id=job_id)
+            }), 202
+
+        return jsonify(process_upload(email, image_bytes, f.filename))
 
-        # Save prescription JSON locally
-        out_filename = f"medicines_{uuid.uuid4().hex}.json"
-        out_path = os.path.join(DATA_DIR, out_filename)
-        with open(out_path, "w", encoding="utf-8") as fp:
-            json.dump(data, fp, ensure_ascii=False, indent=2)
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
 
-        # Save prescription + image in MongoDB
-        with open(save_path, "rb") as img_fp:
-            image_bytes = img_fp.read()
 
-        from db_utils import save_prescription  # make sure this imports your function
-        save_prescription(
-            email=email,
-            data=data,
-            filename=out_filename,
-            image_bytes=image_bytes,
-            image_name=f.filename
-        )
+# ---------- Streaming extraction ----------
+from flask import Response, stream_with_context
+
+
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.route("/api/prescriptions/stream", methods=["POST"])
+def upload_and_extract_stream():
+    """
+    Upload a prescription image and stream its medicines as Server-Sent Events:
+    - `medicine` {index, medicine}: one per entry, normalized like the other
+      endpoints, sent as soon as the model has finished writing it
+    - `done`: the same payload as POST /api/prescriptions, once everything is saved
+    - `error` {ok: false, error}: extraction or saving failed
+    """
+    f = request.files.get("file")
+    email = request.form.get("string")
+    error = check_upload(f, email)
+    if error:
+        return error
+    started = time.perf_counter()
+    with stage("multipart_save"):
+        image_bytes = f.read()
+    f.close()
+    image_name = f.filename
+
+    def events():
+        try:
+            image_hash = image_sha256(image_bytes)
+            key = cache_key(image_hash, PROMPT_VERSION)
+            items = cached_items(key)
+            cache_status = "miss" if items is None else "hit"
+            model_bytes = model_mime = None
+            if items is None:
+                with stage("model_input"):
+                    model_bytes, model_mime = make_model_input(image_bytes)
+                items = stream_items_with_gemini(model_bytes, model_mime)
+
+            raw, medicines = [], []
+            for item in items:
+                medicine = to_target_schema([item])["medicines"][0]
+                if not medicines:
+                    FIRST_MEDICINE_SECONDS.observe(time.perf_counter() - started)
+                raw.append(item)
+                medicines.append(medicine)
+                yield sse("medicine", {"index": len(medicines) - 1, "medicine": medicine})
+            if cache_status == "miss":
+                cache_items(key, raw)
+
+            data = {"medicines": medicines}
+            out_filename = save_upload(email, data, image_bytes, image_name, image_hash, model_bytes, model_mime)
+            yield sse("done", {"ok": True, "data": data, "file": out_filename, "cache": cache_status})
+        except Exception as e:
+            yield sse("error", {"ok": False, "error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        return jsonify({"ok": True, "data": data, "file": out_filename})
 
+# ---------- Batch uploads ----------
+from db_utils import (
+    build_prescription_entry, save_prescriptions_bulk, save_medicine_files, delete_medicine_files, delete_image
+)
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+# Shared by all batch requests, so total concurrent model calls stay bounded
+BATCH_EXTRACTION_WORKERS = int(os.getenv("BATCH_EXTRACTION_WORKERS", "4"))
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_EXTRACTION_WORKERS, thread_name_prefix="batch-extract")
+
+
+def merge_medicines(pages):
+    """
+    Merge medicines from the pages of one prescription.
+    The same drug listed on several pages is kept once, with the union of its times.
+    """
+    merged = {}
+    for data in pages:
+        for med in data.get("medicines", []):
+            key = med["name"].strip().lower()
+            if key not in merged:
+                merged[key] = dict(med, time=list(med.get("time", [])))
+                continue
+            existing = merged[key]
+            existing["time"] = sorted(set(existing["time"]) | set(med.get("time", [])))
+            if med.get("notes") and med["notes"] not in existing.get("notes", ""):
+                existing["notes"] = "; ".join(filter(None, [existing.get("notes"), med["notes"]]))
+    return {"medicines": list(merged.values())}
+
+
+def discard_stored(filenames, image_ids):
+    """Best-effort removal of the medicines JSON and GridFS images of a batch whose entries were not saved."""
+    try:
+        delete_medicine_files(filenames)
     except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        print(f"⚠️ Could not remove medicines files {filenames}: {e}")
+    for file_id in image_ids:
+        try:
+            delete_image(file_id)
+        except Exception as e:
+            print(f"⚠️ Could not remove image {file_id}: {e}")
+
+
+@app.route("/api/prescriptions/batch", methods=["POST"])
+def upload_and_extract_batch():
+    """
+    Upload several images in one multipart request (field "files", repeated).
+    Extraction runs in parallel; all MongoDB entries are written in one operation.
+    Each file gets its own result, so one bad page does not fail the batch.
+    With merge=1 the pages are treated as one prescription and stored as a single entry.
+    """
+    files = request.files.getlist("files") or request.files.getlist("file")
+    email = request.form.get("string") or request.form.get("email")
+    merge = (request.args.get("merge") or request.form.get("merge") or "").lower() in ("1", "true", "yes")
+
+    if not email:
+        return jsonify({"error": "Email is required"}), 400
+    if not files:
+        return jsonify({"error": "No files found in field 'files'"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {BATCH_MAX_FILES} files per batch"}), 400
+    if not USE_GEMINI:
+        return jsonify({"error": "Gemini API not configured"}), 500
+
+    results = [{"filename": f.filename, "ok": False} for f in files]
+    futures = {}
+    uploads = {}
+    hashes = {}
+    for i, f in enumerate(files):
+        ext = os.path.splitext(f.filename or "")[1].lower()
+        if ext not in [".jpg", ".jpeg", ".png"]:
+            results[i]["error"] = "Only .jpg, .jpeg, .png supported"
+            continue
+        with stage("multipart_save"):
+            uploads[i] = f.read()
+        hashes[i] = image_sha256(uploads[i])
+        futures[i] = batch_executor.submit(extract_upload, uploads[i], hashes[i])
+
+    extracted = {}
+    for i, future in futures.items():
+        try:
+            extracted[i] = future.result()
+        except Exception as e:
+            results[i]["error"] = str(e)
+
+    entries = []
+    # (file index, its result fields, the entry or page its derivatives belong to); applied once stored
+    stored = []
+    filenames, image_ids = [], []
+    order = sorted(extracted)
+    try:
+        if merge and extracted:
+            data = merge_medicines([extracted[i][0] for i in order])
+            out_filename = save_medicine_json(email, data)
+            filenames.append(out_filename)
+            pages = []
+            for i in order:
+                pages.append(build_prescription_entry(email, None, out_filename, uploads[i], files[i].filename, hashes[i]))
+                image_ids.append(pages[-1]["image_file_id"])
+                stored.append((i, {"file": out_filename, "cache": extracted[i][1]}, pages[-1]))
+            # The first page is the entry's primary image; every page stays referenced
+            entry = dict(pages[0], data=data, pages=[
+                {k: p[k] for k in ("image_name", "image_file_id", "image_size", "image_sha256")} for p in pages
+            ])
+            entries.append(entry)
+        else:
+            # Every file's medicines JSON in one insert
+            with stage("medicine_file_write"):
+                filenames = save_medicine_files(email, [extracted[i][0] for i in order])
+            for i, out_filename in zip(order, filenames):
+                data, cache_status = extracted[i][:2]
+                entry = build_prescription_entry(email, data, out_filename, uploads[i], files[i].filename, hashes[i])
+                image_ids.append(entry["image_file_id"])
+                entries.append(entry)
+                stored.append((i, {"data": data, "file": out_filename, "cache": cache_status}, entry))
+
+        with stage("mongo_write"):
+            save_prescriptions_bulk(email, entries)
+    except Exception as e:
+        # Nothing references what was stored so far; remove it rather than leave orphans
+        discard_stored(filenames, image_ids)
+        for i in extracted:
+            results[i]["error"] = f"Could not save prescription: {e}"
+        return jsonify({"ok": False, "error": str(e), "succeeded": 0, "failed": len(results), "results": results}), 500
+
+    for i, fields, entry in stored:
+        results[i].update(ok=True, **fields)
+        save_derivatives(entry, uploads[i], extracted[i][2], extracted[i][3])
+
+    succeeded = sum(1 for r in results if r["ok"])
+    payload = {
+        "ok": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+    if merge and entries:
+        payload["data"] = entries[0]["data"]
+        payload["file"] = entries[0]["file"]
+    if succeeded:
+        return jsonify(payload), 200
+    # Every file rejected before extraction (e.g. unsupported type) is the client's error
+    return jsonify(payload), (400 if not futures else 500)
+
+
+# ---------- Async extraction jobs ----------
+from flask import url_for, Response, stream_with_context
+from extraction_jobs import JobQueue, QueueFull, FINISHED
+
+job_queue = JobQueue()
+
+JOB_LONG_POLL_MAX_SECONDS = 30
+JOB_SSE_KEEPALIVE_SECONDS = 15
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status; ?wait=N long-polls up to N seconds for the job to finish."""
+    try:
+        wait = min(float(request.args.get("wait", 0)), JOB_LONG_POLL_MAX_SECONDS)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def stream_job_events(job_id):
+    """Server-Sent Events: one `status` event now, one `result` event when the job finishes."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def events():
+        current = job
+        yield f"event: status\ndata: {json.dumps({'id': job_id, 'status': current['status']})}\n\n"
+        while current is not None and current["status"] not in FINISHED:
+            current = job_queue.wait(job_id, JOB_SSE_KEEPALIVE_SECONDS)
+            if current is not None and current["status"] not in FINISHED:
+                yield ": keepalive\n\n"
+        yield f"event: result\ndata: {json.dumps(current, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.route("/api/medicines/<filename>", methods=["GET"])
 def get_medicines(filename):
-    return send_from_directory(DATA_DIR, filename, as_attachment=True)
+    """Download one extraction's medicines JSON."""
+    doc = get_medicine_file(filename)
+    if doc is None:
+        return jsonify({"error": "File not found"}), 404
+    return Response(
+        json.dumps(doc["data"], ensure_ascii=False, indent=2),
+        mimetype="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.route("/api/medicines/latest", methods=["GET"])
 def get_latest_medicines():
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith(".json")]
-    if not files:
+    """The caller's most recent extraction (?email=...)."""
+    email = request.args.get("email")
+    if not email:
+        return jsonify({"error": "email is required"}), 400
+    doc = get_latest_medicine_file(email)
+    if doc is None:
         return jsonify({"error": "No medicines stored yet"}), 404
-    latest = max(files, key=lambda f: os.path.getctime(os.path.join(DATA_DIR, f)))
-    with open(os.path.join(DATA_DIR, latest), "r", encoding="utf-8") as fp:
-        data = json.load(fp)
-    return jsonify({"file": latest, "data": data})
+    return jsonify({"file": doc["_id"], "data": doc["data"]})
 
 @app.route("/api/prescriptions/save", methods=["POST"])
 def save_prescription_api():
@@ -261,47 +718,119 @@ def get_prescriptions_api(email):
 
 
 # Retrieve Images
-from flask import send_file, jsonify, request
-import io  # standard Python module
+from flask import send_file, jsonify, request, Response, url_for
+from werkzeug.wsgi import wrap_file
+import mimetypes
+from gridfs.errors import NoFile
+from bson import ObjectId
+from bson.errors import InvalidId
 
-from db_utils import get_prescriptions  # use your helper from db_utils
-@app.route("/api/prescriptions/images", methods=["POST"])
-def get_prescription_images():
-    try:
-        data = request.get_json()
-        if not data or "email" not in data:
-            return jsonify({"error": "Email is required in request body"}), 400
+from db_utils import get_prescriptions, list_prescription_images
 
-        email = data["email"].strip().lower()
-        prescriptions_list = get_prescriptions_with_images(email)
+IMAGE_CACHE_SECONDS = 30 * 24 * 3600
 
-        if not prescriptions_list:
+@app.route("/api/prescriptions/images", methods=["GET", "POST"])
+def get_prescription_images():
+    """
+    Cursor-paginated image metadata, newest first. Image bytes are fetched
+    separately from image_url so clients only download what is on screen.
+    Query (or JSON body for POST): email, cursor, limit.
+    """
+    try:
+        if request.method == "POST":
+            params = request.get_json(silent=True) or {}
+        else:
+            params = request.args
+        email = (params.get("email") or "").strip().lower()
+        if not email:
+            return jsonify({"error": "Email is required"}), 400
+
+        before = params.get("cursor") or None
+        if before is not None and not ObjectId.is_valid(before):
+            return jsonify({"error": "Invalid cursor"}), 400
+        try:
+            limit = int(params.get("limit", 20))
+        except (TypeError, ValueError):
+            return jsonify({"error": "limit must be an integer"}), 400
+
+        page, next_cursor = list_prescription_images(email, before=before, limit=limit)
+        if not page and before is None:
             return jsonify({"error": "No prescriptions found for this email"}), 404
 
-        import base64
         images_data = []
-        for pres in prescriptions_list:
-            if "image_bytes" in pres and "image_name" in pres:
-                img_b64 = base64.b64encode(pres["image_bytes"]).decode("utf-8")
-                images_data.append({
-                    "file": pres["file"],
-                    "image_name": pres["image_name"],
-                    "image_base64": img_b64,
-                    "date": pres.get("date")
-                })
-
-        return jsonify({"email": email, "prescriptions": images_data})  
+        for pres in page:
+            image_id = pres.get("image_file_id")
+            images_data.append({
+                "file": pres["file"],
+                "image_name": pres.get("image_name"),
+                "image_id": image_id,
+                "image_size": pres.get("image_size"),
+                "image_url": url_for("get_prescription_image", image_id=image_id) if image_id else None,
+                "thumbnail_url": url_for("get_prescription_image", image_id=image_id, variant="thumb") if image_id else None,
+                "date": pres.get("date")
+            })
+
+        return jsonify({"email": email, "prescriptions": images_data, "next_cursor": next_cursor})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+
+@app.route("/api/prescriptions/images/<image_id>", methods=["GET"])
+def get_prescription_image(image_id):
+    """
+    Stream one stored image straight from GridFS, with ETag and Range support.
+    ?variant=thumb|model serves a downscaled derivative, rendering it on first request.
+    """
+    variant = request.args.get("variant", "original")
+    try:
+        grid_out = open_image_variant(image_id, variant)
+    except (NoFile, InvalidId):
+        return jsonify({"error": "Image not found"}), 404
+
+    mimetype = (
+        getattr(grid_out, "content_type", None)
+        or mimetypes.guess_type(grid_out.filename or "")[0]
+        or "image/jpeg"
+    )
+    resp = Response(
+        wrap_file(request.environ, grid_out),
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    resp.content_length = grid_out.length
+    # Stored images are immutable, so the content hash is a strong validator
+    resp.set_etag(getattr(grid_out, "sha256", None) or str(grid_out._id))
+    resp.last_modified = grid_out.upload_date
+    resp.cache_control.private = True
+    resp.cache_control.max_age = IMAGE_CACHE_SECONDS
+    return resp.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+
 # calender
 
 from flask import Flask, request, jsonify   
-from calendar_utils import authenticate_google, add_medicine_events
+from calendar_utils import authenticate_google, add_medicine_events, CalendarAuthRequired
+from calendar_sync import sync_prescription_events, PrescriptionNotFound
 from db_utils import save_medicines
 
 
+# ---------- Diagnostics ----------
+from mongo_conn import pool_stats
+
+@app.route("/api/db/pool", methods=["GET"])
+def db_pool_status():
+    """MongoDB connection pool configuration and usage counters for this worker."""
+    return jsonify(pool_stats())
+
+
+import metrics
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's pipeline metrics."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/add_medicines", methods=["POST"])
 def add_medicines():
     """
@@ -326,6 +855,33 @@ def add_medicines():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/calendar/sync", methods=["POST"])
+def sync_calendar():
+    """
+    Sync one saved prescription to the user's Google Calendar.
+    Expected JSON format:
+    {
+        "email": "user@example.com",
+        "file": "medicines_1700000000.json"
+    }
+    Only the inserts, patches and deletes needed are sent; an unchanged
+    prescription makes no API calls.
+    """
+    data = request.get_json(silent=True) or {}
+    email = (data.get("email") or "").strip()
+    filename = data.get("file")
+    if not email or not filename:
+        return jsonify({"error": "email and file are required"}), 400
+
+    try:
+        counts = sync_prescription_events(lambda: authenticate_google(email, interactive=False), email, filename)
+    except PrescriptionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except CalendarAuthRequired as e:
+        return jsonify({"error": str(e)}), 401
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"file": filename, **counts}), 200
 
 
 if __name__ == "__main__":
@@ -1,55 +1,237 @@
+import os
+import json
+import time
+import random
+import hashlib
 import datetime
-from googleapiclient.discovery import build
+import threading
+import urllib.request
+from collections import OrderedDict
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import InstalledAppFlow
 
 # Google Calendar scope
 SCOPES = ['https://www.googleapis.com/auth/calendar.events']
 
-def authenticate_google(email: str):
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+# One authorized-user file (with refresh token) per email
+GOOGLE_TOKEN_DIR = os.getenv("GOOGLE_TOKEN_DIR", os.path.join(CACHE_DIR, "google_tokens"))
+GOOGLE_CLIENT_SECRETS = os.getenv("GOOGLE_CLIENT_SECRETS", "credentials.json")
+# Local copy of the Calendar v3 discovery document, fetched once
+CALENDAR_DISCOVERY_PATH = os.getenv("CALENDAR_DISCOVERY_PATH", os.path.join(CACHE_DIR, "calendar_v3_discovery.json"))
+CALENDAR_DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest"
+# Credentials kept in memory per email (least recently used are dropped)
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CALENDAR_CREDENTIALS_CACHE_SIZE", "128"))
+
+# Calendar API batch requests hold at most 50 calls
+BATCH_SIZE = 50
+# Rounds of retries for calls rejected by rate limits
+MAX_RETRIES = 5
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+class CalendarAuthRequired(Exception):
+    """No stored (or refreshable) credentials for an email and the browser flow is not allowed."""
+
+
+_lock = threading.Lock()
+_discovery_doc = None
+_credentials = OrderedDict()
+
+
+def token_path(email):
+    """Token file for an email (hashed, so addresses never end up in file names)."""
+    digest = hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()
+    return os.path.join(GOOGLE_TOKEN_DIR, f"{digest}.json")
+
+
+def save_credentials(email, creds):
+    path = token_path(email)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(creds.to_json())
+    os.replace(tmp, path)
+
+
+def load_credentials(email, interactive=True):
+    """
+    Stored credentials for email, refreshed silently when expired.
+    Only when there are none (or the refresh token was revoked) does the browser
+    flow run, and only if interactive; otherwise CalendarAuthRequired is raised.
     """
-    Authenticate and return the calendar service object.
-    Currently, it launches OAuth browser flow each time.
+    path = token_path(email)
+    creds = Credentials.from_authorized_user_file(path, SCOPES) if os.path.exists(path) else None
+
+    if creds is not None and not creds.valid and creds.refresh_token:
+        try:
+            creds.refresh(Request())
+            save_credentials(email, creds)
+        except Exception as e:
+            print(f"⚠️ Could not refresh Google credentials for {email}: {e}")
+            creds = None
+
+    if creds is None or not creds.valid:
+        if not interactive:
+            raise CalendarAuthRequired(f"Google Calendar is not authorized for {email}")
+        flow = InstalledAppFlow.from_client_secrets_file(GOOGLE_CLIENT_SECRETS, SCOPES)
+        creds = flow.run_local_server(port=0)
+        save_credentials(email, creds)
+    return creds
+
+
+def calendar_discovery_doc():
+    """Calendar v3 discovery document: in memory, else the local copy, else fetched once and saved."""
+    global _discovery_doc
+    if _discovery_doc is None:
+        if os.path.exists(CALENDAR_DISCOVERY_PATH):
+            with open(CALENDAR_DISCOVERY_PATH) as f:
+                _discovery_doc = f.read()
+        else:
+            with urllib.request.urlopen(CALENDAR_DISCOVERY_URL, timeout=30) as resp:
+                doc = resp.read().decode("utf-8")
+            json.loads(doc)  # never cache an error page
+            os.makedirs(os.path.dirname(CALENDAR_DISCOVERY_PATH), exist_ok=True)
+            with open(CALENDAR_DISCOVERY_PATH, "w") as f:
+                f.write(doc)
+            _discovery_doc = doc
+    return _discovery_doc
+
+
+def cached_credentials(email, interactive=True):
+    """Credentials for email, kept in memory (LRU, CREDENTIALS_CACHE_SIZE) while they are valid."""
+    with _lock:
+        creds = _credentials.get(email)
+        if creds is not None:
+            _credentials.move_to_end(email)
+    if creds is not None and creds.valid:
+        return creds
+
+    creds = load_credentials(email, interactive=interactive)
+    with _lock:
+        _credentials[email] = creds
+        _credentials.move_to_end(email)
+        while len(_credentials) > CREDENTIALS_CACHE_SIZE:
+            _credentials.popitem(last=False)
+    return creds
+
+
+def authenticate_google(email: str, interactive=True):
     """
-    flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-    creds = flow.run_local_server(port=0)
-    service = build("calendar", "v3", credentials=creds)
-    return service
+    Return a new calendar service object for email.
+    A service wraps one httplib2.Http, which is not thread-safe, so every call
+    builds its own; that only parses the local discovery document (no network).
+    Credentials come from memory or the per-email token store, so the OAuth
+    browser flow only runs the first time (and never when interactive=False,
+    e.g. from a server process).
+    """
+    creds = cached_credentials(email, interactive=interactive)
+    return build_from_document(calendar_discovery_doc(), credentials=creds)
+
+
+def _as_date(value):
+    # Medicines from requests carry "YYYY-MM-DD"; stored ones carry BSON dates
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def medicine_event(med, intake_time, email):
+    """Calendar event body for one medicine at one intake time (daily until end_date)."""
+    start_date = _as_date(med["start_date"])
+    end_date = _as_date(med["end_date"])
+    start_datetime = datetime.datetime.combine(
+        start_date,
+        datetime.datetime.strptime(intake_time, "%H:%M").time()
+    )
+    end_datetime = start_datetime + datetime.timedelta(minutes=30)
+
+    return {
+        "summary": f"Take {med['name']}",
+        "description": med.get("notes", ""),
+        "start": {"dateTime": start_datetime.isoformat(), "timeZone": "Asia/Kolkata"},
+        "end": {"dateTime": end_datetime.isoformat(), "timeZone": "Asia/Kolkata"},
+        "recurrence": [
+            f"RRULE:FREQ=DAILY;UNTIL={end_date.strftime('%Y%m%d')}T235959Z"
+        ],
+        "attendees": [{"email": email}],
+        "reminders": {
+            "useDefault": False,
+            "overrides": [
+                {"method": "popup", "minutes": 10},
+                {"method": "email", "minutes": 30}
+            ]
+        },
+    }
+
+
+def build_medicine_events(medicines, email):
+    """
+    Calendar event bodies for medicines: one daily recurring event per intake time.
+    """
+    return [medicine_event(med, intake_time, email) for med in medicines for intake_time in med["time"]]
+
+
+def is_rate_limited(error):
+    """429s, and 403s whose reason is a (user) rate limit, are worth retrying."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (status == 403 and any(reason in str(error.content) for reason in RATE_LIMIT_REASONS))
+
+
+def execute_batched(service, requests, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES):
+    """
+    Run API requests through the batch HTTP interface, batch_size calls per round trip.
+    Calls rejected by rate limits are retried in later rounds with exponential backoff.
+    Returns one (response, error) pair per request, in order.
+    """
+    results = [None] * len(requests)
+    pending = list(range(len(requests)))
+
+    for attempt in range(max_retries + 1):
+        retry = []
+        for chunk_start in range(0, len(pending), batch_size):
+            chunk = pending[chunk_start:chunk_start + batch_size]
+
+            def callback(request_id, response, exception):
+                index = int(request_id)
+                if exception is not None and is_rate_limited(exception) and attempt < max_retries:
+                    retry.append(index)
+                else:
+                    results[index] = (response, exception)
+
+            batch = service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(requests[index], request_id=str(index))
+            batch.execute()
+
+        if not retry:
+            break
+        delay = random.uniform(0, 2 ** attempt)
+        print(f"🔁 {len(retry)} calendar calls rate limited, retrying in {delay:.1f}s")
+        time.sleep(delay)
+        pending = sorted(retry)
+
+    return results
+
 
 def add_medicine_events(service, medicines, email):
     """
     Add recurring events for medicines to Google Calendar.
+    Inserts go out in batches of up to BATCH_SIZE per HTTP round trip; failed
+    items are logged and left out of the returned links.
     """
+    events = build_medicine_events(medicines, email)
+    requests = [service.events().insert(calendarId="primary", body=event) for event in events]
+
     created_events = []
-    for med in medicines:
-        start_date = datetime.datetime.strptime(med["start_date"], "%Y-%m-%d").date()
-        end_date = datetime.datetime.strptime(med["end_date"], "%Y-%m-%d").date()
-
-        for intake_time in med["time"]:
-            start_datetime = datetime.datetime.combine(
-                start_date,
-                datetime.datetime.strptime(intake_time, "%H:%M").time()
-            )
-            end_datetime = start_datetime + datetime.timedelta(minutes=30)
-
-            event = {
-                "summary": f"Take {med['name']}",
-                "description": med.get("notes", ""),
-                "start": {"dateTime": start_datetime.isoformat(), "timeZone": "Asia/Kolkata"},
-                "end": {"dateTime": end_datetime.isoformat(), "timeZone": "Asia/Kolkata"},
-                "recurrence": [
-                    f"RRULE:FREQ=DAILY;UNTIL={end_date.strftime('%Y%m%d')}T235959Z"
-                ],
-                "attendees": [{"email": email}],
-                "reminders": {
-                    "useDefault": False,
-                    "overrides": [
-                        {"method": "popup", "minutes": 10},
-                        {"method": "email", "minutes": 30}
-                    ]
-                },
-            }
-
-            event_result = service.events().insert(calendarId="primary", body=event).execute()
-            created_events.append(event_result.get("htmlLink"))
+    for event, (response, error) in zip(events, execute_batched(service, requests)):
+        if error is not None:
+            print(f"❌ Could not create calendar event '{event['summary']}' for {email}: {error}")
+            continue
+        created_events.append(response.get("htmlLink"))
 
     return created_events
@@ -0,0 +1,134 @@
+"""
+Incremental Google Calendar sync for one prescription.
+
+Each prescription entry keeps the events created for it in `calendar_events`:
+
+    [{"key": "<medicine name>|<HH:MM>", "event_id": "...", "hash": "<sha1 of body>"}]
+
+A sync builds the desired events from the entry's medicines, diffs them against
+that list by key and body hash, and sends only the inserts, patches and deletes
+needed (batched, see calendar_utils.execute_batched). Re-syncing an unchanged
+prescription makes no API calls and no writes.
+"""
+import json
+import hashlib
+
+from googleapiclient.errors import HttpError
+
+from calendar_utils import medicine_event, execute_batched
+from db_utils import get_prescription_entry, set_calendar_events
+
+
+class PrescriptionNotFound(Exception):
+    """No prescription entry with that filename for that email."""
+
+
+def event_key(med, intake_time):
+    return f"{med['name']}|{intake_time}"
+
+
+def event_hash(body):
+    return hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def desired_events(medicines, email):
+    """{key: event body} for every medicine x intake time (later duplicates win)."""
+    return {
+        event_key(med, t): medicine_event(med, t, email)
+        for med in medicines for t in med.get("time", [])
+    }
+
+
+def diff_events(desired, existing):
+    """
+    Compare desired bodies with stored events.
+    Returns (inserts, patches, deletes, unchanged):
+    - inserts: keys with no event yet
+    - patches / unchanged: stored events whose body changed / did not
+    - deletes: stored events no longer wanted
+    """
+    stored = {e["key"]: e for e in existing}
+    inserts = [k for k in desired if k not in stored]
+    patches, unchanged = [], []
+    for key, event in stored.items():
+        if key in desired:
+            (unchanged if event["hash"] == event_hash(desired[key]) else patches).append(event)
+    deletes = [e for k, e in stored.items() if k not in desired]
+    return inserts, patches, deletes, unchanged
+
+
+def _gone(error):
+    return isinstance(error, HttpError) and error.resp.status in (404, 410)
+
+
+def sync_prescription_events(service, email, filename):
+    """
+    Bring the calendar in line with one prescription entry.
+    - service: calendar service, or a callable returning one; a callable is only
+      invoked when there is something to send, so no-op syncs skip auth entirely
+    Returns counts of inserted, patched, deleted, unchanged and failed events.
+    """
+    entry = get_prescription_entry(email, filename)
+    if entry is None:
+        raise PrescriptionNotFound(f"No prescription {filename} for {email}")
+
+    medicines = (entry.get("data") or {}).get("medicines", [])
+    desired = desired_events(medicines, email)
+    existing = entry.get("calendar_events", [])
+    inserts, patches, deletes, unchanged = diff_events(desired, existing)
+    counts = {"inserted": 0, "patched": 0, "deleted": 0, "unchanged": len(unchanged), "failed": 0}
+    if not (inserts or patches or deletes):
+        return counts
+
+    if callable(service):
+        service = service()
+    events = service.events()
+    result = {e["key"]: e for e in unchanged}
+
+    # Every change in one batched run (ceil(changes / 50) round trips)
+    results = execute_batched(service, (
+        [events.patch(calendarId="primary", eventId=e["event_id"], body=desired[e["key"]]) for e in patches]
+        + [events.insert(calendarId="primary", body=desired[key]) for key in inserts]
+        + [events.delete(calendarId="primary", eventId=e["event_id"]) for e in deletes]
+    ))
+    patch_results = results[:len(patches)]
+    insert_results = results[len(patches):len(patches) + len(inserts)]
+    delete_results = results[len(patches) + len(inserts):]
+
+    recreate = []
+    for event, (response, error) in zip(patches, patch_results):
+        if error is None:
+            result[event["key"]] = dict(event, hash=event_hash(desired[event["key"]]))
+            counts["patched"] += 1
+        elif _gone(error):
+            # Deleted on the calendar side: recreate instead of patching
+            recreate.append(event["key"])
+        else:
+            print(f"❌ Could not update calendar event {event['key']} for {email}: {error}")
+            result[event["key"]] = event
+            counts["failed"] += 1
+
+    if recreate:
+        insert_results += execute_batched(service, [
+            events.insert(calendarId="primary", body=desired[key]) for key in recreate
+        ])
+        inserts += recreate
+    for key, (response, error) in zip(inserts, insert_results):
+        if error is None:
+            result[key] = {"key": key, "event_id": response["id"], "hash": event_hash(desired[key])}
+            counts["inserted"] += 1
+        else:
+            print(f"❌ Could not create calendar event {key} for {email}: {error}")
+            counts["failed"] += 1
+
+    for event, (response, error) in zip(deletes, delete_results):
+        if error is None or _gone(error):
+            counts["deleted"] += 1
+        else:
+            # Keep the id so the next sync tries again
+            print(f"❌ Could not delete calendar event {event['key']} for {email}: {error}")
+            result[event["key"]] = event
+            counts["failed"] += 1
+
+    set_calendar_events(email, filename, list(result.values()))
+    return counts
@@ -0,0 +1,67 @@
+"""
+Index bootstrap for medicines_db.
+
+Every statement is a create_index call, which is a no-op when the index already
+exists, so ensure_indexes() can run at every start-up of the backend and the
+reminder service.
+"""
+from pymongo import ASCENDING, DESCENDING
+
+INDEXES = {
+    "prescriptions": [
+        # One document per user; backs every lookup and upsert by email
+        {"keys": [("email", ASCENDING)], "unique": True},
+        # Multikey: delete / lookup of a single prescription by its JSON filename
+        {"keys": [("prescriptions.file", ASCENDING)]},
+    ],
+    "medicines": [
+        {"keys": [("email", ASCENDING)], "unique": True},
+        # Multikey: expiry sweeps over individual medicine end dates
+        {"keys": [("medicines.end_date", ASCENDING)]},
+        # Reminder service's watermark poll (when change streams are unavailable)
+        {"keys": [("updated_at", ASCENDING)]},
+    ],
+    "medicine_files": [
+        # Latest extraction per user (_id is the filename, so lookups by name need nothing extra)
+        {"keys": [("email", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "fs.files": [
+        # Derivative lookup (thumbnail / model input of an original image)
+        {"keys": [("derived_from", ASCENDING), ("variant", ASCENDING)], "sparse": True},
+        # Resumable GridFS migration
+        {"keys": [("migrated_from", ASCENDING)], "sparse": True},
+    ],
+    # --- reminder service ---
+    "reminder_doses": [
+        # Replace one user's doses; load the doses of the shards a worker holds
+        {"keys": [("user_id", ASCENDING)]},
+        {"keys": [("shard", ASCENDING)]},
+    ],
+    "reminder_state": [
+        {"keys": [("shard", ASCENDING)]},
+    ],
+    "reminder_leases": [
+        {"keys": [("owner", ASCENDING)]},
+    ],
+    "reminder_workers": [
+        # Drop heartbeats of dead workers
+        {"keys": [("expires_at", ASCENDING)], "expireAfterSeconds": 0},
+    ],
+    "reminder_sent": [
+        # Idempotency keys only need to outlive the catch-up window
+        {"keys": [("sent_at", ASCENDING)], "expireAfterSeconds": 3 * 24 * 3600},
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Create every index in INDEXES on db. Returns the index names, per collection."""
+    created = {}
+    for collection, specs in INDEXES.items():
+        names = []
+        for spec in specs:
+            spec = dict(spec)
+            keys = spec.pop("keys")
+            names.append(db[collection].create_index(keys, **spec))
+        created[collection] = names
+    return created
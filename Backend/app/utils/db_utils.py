@@ -1,19 +1,31 @@
-from pymongo import MongoClient
 from datetime import datetime
 import os
-from pymongo.mongo_client import MongoClient
-from dotenv import load_dotenv
 import gridfs
+import uuid
+import hashlib
+from bson import ObjectId
+from mongo_conn import get_client, get_db
+from db_indexes import ensure_indexes as _ensure_indexes
+from medicine_expiry import to_bson_date
 
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
-db = client["medicines_db"]
+# Shared, pooled client (configured in mongo_conn from the environment)
+client = get_client()
+db = get_db()
 fs = gridfs.GridFS(db)
 prescriptions = db["prescriptions"]
 medicines_collection = db["medicines"]
+# Extracted medicines JSON per upload, keyed by its filename (formerly data/medicines_<id>.json)
+medicine_files = db["medicine_files"]
 
-def save_prescription(email, data=None, filename=None, image_bytes=None, image_name=None):
+def ensure_indexes():
+    """
+    Idempotent index bootstrap (see db_indexes); safe to call on every start-up.
+    The unique email indexes back the upsert write paths: one document per user.
+    """
+    return _ensure_indexes(db)
+
+
+def save_prescription(email, data=None, filename=None, image_bytes=None, image_name=None, sha256=None):
     """
     Save a prescription JSON and its image for a user.
     - email: user's email
@@ -21,46 +33,217 @@ def save_prescription(email, data=None, filename=None, image_bytes=None, image_n
     - filename: JSON filename (string)
     - image_bytes: raw image bytes (binary)
     - image_name: original image filename
+    - sha256: hex digest of image_bytes, if the caller already computed it
+    Returns the stored entry (truthy), including image_file_id when an image was given.
     """
-    record = prescriptions.find_one({"email": email})
+    entry = build_prescription_entry(email, data, filename, image_bytes, image_name, sha256)
 
+    # Append, creating the user document on first save, in one atomic round trip
+    prescriptions.update_one(
+        {"email": email},
+        {"$push": {"prescriptions": {"$each": [entry]}}},
+        upsert=True
+    )
+
+    return entry
+
+
+def build_prescription_entry(email, data=None, filename=None, image_bytes=None, image_name=None, sha256=None):
+    """Embedded prescription entry; the image (if any) is put into GridFS and referenced."""
     entry = {
         "file": filename if filename else f"medicines_{int(datetime.now().timestamp())}.json",
         "data": data if data else {},
         "image_name": image_name if image_name else "unknown",
-        "image_bytes": image_bytes,  # store binary
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        # Stable, time-ordered key for paging (array positions shift on delete)
+        "entry_id": ObjectId()
     }
+    if image_bytes is not None:
+        # Image lives in GridFS; the embedded entry only keeps a reference
+        entry.update(store_image(image_bytes, image_name=entry["image_name"], email=email, sha256=sha256))
+    return entry
 
-    if record:
-        # Append new prescription
-        email = email.strip()
-        prescriptions.update_one(
-            {"email": email},
-            {"$push": {"prescriptions": entry}}
-        )
-    else:
-        # Create new user with first prescription
-        prescriptions.insert_one({
-            "email": email,
-            "prescriptions": [entry]
-        })
 
-    return True
+def save_prescriptions_bulk(email, entries):
+    """
+    Append several prebuilt entries (see build_prescription_entry) in one write.
+    Creates the user document if it does not exist yet.
+    """
+    if not entries:
+        return 0
+    prescriptions.update_one(
+        {"email": email},
+        {"$push": {"prescriptions": {"$each": entries}}},
+        upsert=True
+    )
+    return len(entries)
+
+
+def store_image(image_bytes, image_name=None, email=None, sha256=None, **metadata):
+    """
+    Put raw image bytes into GridFS.
+    Returns the reference fields kept on the embedded prescription entry.
+    """
+    sha256 = sha256 or hashlib.sha256(image_bytes).hexdigest()
+    file_id = fs.put(
+        image_bytes,
+        filename=image_name or "unknown",
+        email=email,
+        sha256=sha256,
+        **metadata
+    )
+    return {
+        "image_file_id": file_id,
+        "image_size": len(image_bytes),
+        "image_sha256": sha256
+    }
+
+
+def save_medicine_file(email, data, filename=None, created_at=None):
+    """
+    Store the extracted medicines JSON of one upload. Returns its filename, the
+    name prescription entries and the /api/medicines endpoints refer to it by.
+    Upserts, so re-importing a file is harmless.
+    """
+    filename = filename or f"medicines_{uuid.uuid4().hex}.json"
+    medicine_files.replace_one(
+        {"_id": filename},
+        {"email": email, "data": data, "created_at": created_at or datetime.now()},
+        upsert=True
+    )
+    return filename
+
+
+def save_medicine_files(email, datas):
+    """
+    Store several extracted medicines JSONs (one batch upload) in a single insert.
+    Returns their filenames, in order. On failure none of them is left behind.
+    """
+    if not datas:
+        return []
+    now = datetime.now()
+    docs = [{"_id": f"medicines_{uuid.uuid4().hex}.json", "email": email, "data": data, "created_at": now}
+            for data in datas]
+    try:
+        medicine_files.insert_many(docs, ordered=False)
+    except Exception:
+        delete_medicine_files([doc["_id"] for doc in docs])
+        raise
+    return [doc["_id"] for doc in docs]
+
+
+def delete_medicine_files(filenames):
+    """Remove stored medicines JSONs by filename. Returns how many existed."""
+    if not filenames:
+        return 0
+    return medicine_files.delete_many({"_id": {"$in": list(filenames)}}).deleted_count
+
+
+def get_medicine_file(filename):
+    """One stored medicines JSON by filename, or None."""
+    return medicine_files.find_one({"_id": filename})
+
+
+def get_latest_medicine_file(email):
+    """The user's most recent medicines JSON (a single (email, created_at) index seek), or None."""
+    return medicine_files.find_one({"email": email}, sort=[("created_at", -1)])
+
+
+def delete_image(file_id):
+    """Remove an image (stored by store_image) and its derivatives (thumb / model) from GridFS."""
+    for derivative in fs.find({"derived_from": file_id}):
+        fs.delete(derivative._id)
+    fs.delete(file_id)
+
+
+def open_prescription_image(file_id):
+    """Open a stored image for streaming reads (GridOut: seekable, iterable in chunks)."""
+    if isinstance(file_id, str):
+        file_id = ObjectId(file_id)
+    return fs.get(file_id)
+
+
+def _public_entry(entry):
+    """Make an embedded prescription entry JSON-safe (no raw bytes, string ids)."""
+    entry.pop("image_bytes", None)
+    for key in ("image_file_id", "entry_id"):
+        if key in entry:
+            entry[key] = str(entry[key])
+    return entry
 
 
 def get_prescriptions(email):
     """Fetch all prescriptions for a user (without exposing image bytes directly)."""
     record = prescriptions.find_one({"email": email}, {"_id": 0, "prescriptions.image_bytes": 0})
     if record and "prescriptions" in record:
-        return record["prescriptions"]
+        return [_public_entry(p) for p in record["prescriptions"]]
     return []
 
+def _legacy_entry_id(entry):
+    """Time-ordered id for an entry saved before entries had one: its upload second plus random bytes."""
+    try:
+        seconds = int(datetime.strptime(entry.get("date", ""), "%Y-%m-%d %H:%M:%S").timestamp())
+    except (TypeError, ValueError):
+        seconds = 0
+    return ObjectId(seconds.to_bytes(4, "big") + os.urandom(8))
+
+
+def backfill_entry_ids(email):
+    """Give a user's entries that predate entry_id one (no-op once done). Returns how many."""
+    record = prescriptions.find_one(
+        {"email": email, "prescriptions": {"$elemMatch": {"entry_id": {"$exists": False}}}},
+        {"prescriptions.file": 1, "prescriptions.date": 1, "prescriptions.entry_id": 1}
+    )
+    if not record:
+        return 0
+    filled = 0
+    for entry in record.get("prescriptions", []):
+        if "entry_id" in entry:
+            continue
+        result = prescriptions.update_one(
+            {"email": email, "prescriptions": {"$elemMatch": {"file": entry["file"], "entry_id": {"$exists": False}}}},
+            {"$set": {"prescriptions.$.entry_id": _legacy_entry_id(entry)}}
+        )
+        filled += result.modified_count
+    return filled
+
+
+def list_prescription_images(email, before=None, limit=20):
+    """
+    One page of image metadata for a user, newest first, in a single round trip.
+    - before: cursor = entry_id to page backwards from (exclusive); None = newest.
+      Entries are ordered by their entry_id, so deleting or adding entries between
+      page fetches never makes the next page skip or repeat one.
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit), 100))
+    if before is None:
+        backfill_entry_ids(email)
+    pipeline = [
+        {"$match": {"email": email}},
+        {"$unwind": "$prescriptions"},
+        {"$replaceRoot": {"newRoot": "$prescriptions"}},
+        {"$project": {"image_bytes": 0, "data": 0}}
+    ]
+    if before is not None:
+        pipeline.append({"$match": {"entry_id": {"$lt": ObjectId(before)}}})
+    # One extra entry tells whether there is a next page
+    pipeline += [{"$sort": {"entry_id": -1}}, {"$limit": limit + 1}]
+    entries = list(prescriptions.aggregate(pipeline))
+    page = [_public_entry(p) for p in entries[:limit]]
+    next_cursor = page[-1]["entry_id"] if len(entries) > limit else None
+    return page, next_cursor
+
+
 def get_prescriptions_with_images(email):
-    """Fetch all prescriptions including image bytes."""
+    """Fetch all prescriptions including image bytes (read back from GridFS)."""
     email = email.strip().lower()
     record = prescriptions.find_one({"email": email}, {"_id": 0})
     if record and "prescriptions" in record:
+        for pres in record["prescriptions"]:
+            # Entries not yet migrated still carry embedded image_bytes
+            if "image_file_id" in pres and "image_bytes" not in pres:
+                pres["image_bytes"] = open_prescription_image(pres["image_file_id"]).read()
         return record["prescriptions"]
     return []
 
@@ -71,40 +254,25 @@ def save_prescription_to_db(email, name, data, filename=None):
     Returns True if successful, False otherwise.
     """
     try:
-        load_dotenv()
-        MONGO_URI = os.getenv("MONGO_URI")
-        if not MONGO_URI:
-            raise ValueError("MONGO_URI environment variable not set")
-
-        client = MongoClient(MONGO_URI)
-        db = client["medicines_db"]
-        prescriptions = db["prescriptions"]
-
         # Ensure correct format
         prescription_entry = {
             "file": filename if filename else f"medicines_{int(datetime.now().timestamp())}.json",
             "data": {
                 "medicines": data.get("medicines", [])
             },
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "entry_id": ObjectId()
         }
 
-        # Check if user record exists
-        record = prescriptions.find_one({"email": email})
-
-        if record:
-            # Append new prescription
-            prescriptions.update_one(
-                {"email": email},
-                {"$push": {"prescriptions": prescription_entry}}
-            )
-        else:
-            # Create new user with first prescription
-            prescriptions.insert_one({
-                "email": email,
-                "name": name,
-                "prescriptions": [prescription_entry]
-            })
+        # Append, creating the user document (with name) on first save
+        prescriptions.update_one(
+            {"email": email},
+            {
+                "$push": {"prescriptions": {"$each": [prescription_entry]}},
+                "$setOnInsert": {"name": name}
+            },
+            upsert=True
+        )
 
         return True
 
@@ -114,29 +282,57 @@ def save_prescription_to_db(email, name, data, filename=None):
 
 def get_prescriptions(email):
     """Fetch all prescriptions for a user."""
-    record = prescriptions.find_one({"email": email}, {"_id": 0})
+    record = prescriptions.find_one({"email": email}, {"_id": 0, "prescriptions.image_bytes": 0})
     if record:
-        return record["prescriptions"]
+        return [_public_entry(p) for p in record["prescriptions"]]
     return []
 
 
 # ✅ New helper: get latest prescription for a user
 def get_latest_prescription(email):
     """Fetch the most recent prescription for a user."""
-    record = prescriptions.find_one({"email": email}, {"_id": 0})
+    record = prescriptions.find_one({"email": email}, {"_id": 0, "prescriptions.image_bytes": 0})
     if record and "prescriptions" in record:
-        return record["prescriptions"][-1]  # Last added
+        return _public_entry(record["prescriptions"][-1])  # Last added
     return None
 
 
+def get_prescription_entry(email, filename):
+    """One prescription entry of a user by filename (without image bytes), or None."""
+    record = prescriptions.find_one(
+        {"email": email, "prescriptions.file": filename},
+        {"_id": 0, "prescriptions": {"$elemMatch": {"file": filename}}}
+    )
+    if record and record.get("prescriptions"):
+        return _public_entry(record["prescriptions"][0])
+    return None
+
+
+def set_calendar_events(email, filename, events):
+    """Store the Google Calendar event ids synced for one prescription entry."""
+    result = prescriptions.update_one(
+        {"email": email, "prescriptions.file": filename},
+        {"$set": {"prescriptions.$.calendar_events": events}}
+    )
+    return result.matched_count > 0
+
+
 # ✅ New helper: delete a prescription by filename
 def delete_prescription(email, filename):
-    """Delete a specific prescription for a user by filename."""
-    result = prescriptions.update_one(
-        {"email": email},
-        {"$pull": {"prescriptions": {"file": filename}}}
+    """Delete a specific prescription (and its GridFS images with derivatives) for a user by filename."""
+    before = prescriptions.find_one_and_update(
+        {"email": email, "prescriptions.file": filename},
+        {"$pull": {"prescriptions": {"file": filename}}},
+        projection={"prescriptions": {"$elemMatch": {"file": filename}}}
     )
-    return result.modified_count > 0
+    if not before:
+        return False
+    for pres in before.get("prescriptions", []):
+        # A merged batch entry references every page image; the first is also its own image_file_id
+        image_ids = [pres.get("image_file_id")] + [page.get("image_file_id") for page in pres.get("pages", [])]
+        for file_id in dict.fromkeys(i for i in image_ids if i is not None):
+            delete_image(file_id)
+    return True
 #Add medicines to db
 from datetime import datetime
 
@@ -145,30 +341,25 @@ def save_medicines(email: str, medicines: list):
     Save or update medicines for a given email.
     If email exists, append new medicines to the list.
     Adds a 'duration_days' field for each medicine.
+    start_date / end_date are stored as BSON dates so expiry can run server-side.
     """
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     # Add duration_days for each medicine
     for med in medicines:
-        start_date = datetime.strptime(med["start_date"], "%Y-%m-%d")
-        end_date = datetime.strptime(med["end_date"], "%Y-%m-%d")
+        start_date = to_bson_date(med["start_date"])
+        end_date = to_bson_date(med["end_date"])
+        med["start_date"] = start_date
+        med["end_date"] = end_date
         med["duration_days"] = (end_date - start_date).days + 1  # inclusive of start & end
 
-    # Check if user already exists
-    record = medicines_collection.find_one({"email": email})
-
-    if record:
-        # Append new medicines
-        updated_medicines = record.get("medicines", []) + medicines
-        medicines_collection.update_one(
-            {"email": email},
-            {"$set": {"medicines": updated_medicines, "updated_at": now}}
-        )
-    else:
-        # Insert new record
-        medicines_collection.insert_one({
-            "email": email,
-            "medicines": medicines,
-            "created_at": now,
-            "updated_at": now
-        })
+    # Append server-side: no read-modify-write, so concurrent saves cannot drop entries
+    medicines_collection.update_one(
+        {"email": email},
+        {
+            "$push": {"medicines": {"$each": medicines}},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
@@ -0,0 +1,282 @@
+"""
+Local fuzzy drug-name resolver.
+
+OCR / model output often garbles names ("Tobetas", "Cap. K-Dox"). Instead of
+asking the model again for "the closest reference", names are matched against a
+formulary (one name per line) through a character-trigram index:
+
+- names are normalized (lower case, dosage forms and strengths dropped, only
+  [a-z0-9 ] kept) and padded, then split into trigrams;
+- the alphabet has 37 symbols, so a trigram is a number below 37**3 and the
+  index is a direct-addressed table of postings lists (no hashing, no search);
+- candidates come from the postings of the query's rarest trigrams and are
+  ranked by the Dice coefficient of the trigram sets, read from a forward
+  index (each name's trigram codes) so nothing is re-tokenized at query time.
+
+The index is a single binary file that is memory-mapped on load, so opening a
+100k-name index takes well under a millisecond and involves no parsing; pages
+are shared between worker processes through the OS page cache.
+
+Usage:
+    python drug_names.py build formulary.txt [--index drug_names.idx]
+    python drug_names.py match "Tobetas" [--index drug_names.idx]
+    python drug_names.py bench [--names 100000] [--queries 2000]
+"""
+import os
+import re
+import sys
+import mmap
+import time
+import random
+import argparse
+from array import array
+from collections import Counter
+from itertools import chain
+
+DRUG_INDEX_PATH = os.getenv(
+    "DRUG_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "drug_names.idx")
+)
+
+MAGIC = b"DRUGIDX1"
+ALPHABET = " abcdefghijklmnopqrstuvwxyz0123456789"
+SYMBOL = {c: i for i, c in enumerate(ALPHABET)}
+GRAMS = len(ALPHABET) ** 3
+# Candidate generation reads the postings of the query's rarest trigrams: at least
+# MIN_SEED_GRAMS of them, then more while the postings read stay under POSTINGS_BUDGET
+MIN_SEED_GRAMS = 3
+POSTINGS_BUDGET = 3000
+# Names scored exactly per query
+CANDIDATES = 50
+
+_FORMS = re.compile(r"\b(?:tab|tabs|tablet|cap|caps|capsule|syp|syrup|inj|injection|oint|cream|drops?)\b\.?")
+_STRENGTH = re.compile(r"\b\d+(?:\.\d+)?\s*(?:mg|mcg|g|ml|iu|%)\b")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(name):
+    """'Cap. K-Dox 100mg' -> 'k dox'"""
+    text = _STRENGTH.sub(" ", _FORMS.sub(" ", name.lower()))
+    return " ".join(_NON_ALNUM.sub(" ", text).split())
+
+
+def trigrams(name):
+    """Set of trigram codes of an already normalized name."""
+    padded = f"  {name} "
+    codes = [SYMBOL[c] for c in padded]
+    return {codes[i] * 1369 + codes[i + 1] * 37 + codes[i + 2] for i in range(len(codes) - 2)}
+
+
+def _native(values, typecode="I"):
+    arr = array(typecode, values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def build_index(names, path=DRUG_INDEX_PATH):
+    """
+    Write the index for names to path. Layout (little-endian uint32 unless noted):
+    magic | n_names | names_bytes | name offsets (n_names + 1) | names (utf-8)
+    | gram offsets (n_names + 1) | grams of each name (uint16)
+    | postings offsets (GRAMS + 1) | postings (name ids)
+    """
+    names = sorted({n.strip() for n in names if n.strip() and normalize(n)})
+    postings = [[] for _ in range(GRAMS)]
+    forward = []
+    for name_id, name in enumerate(names):
+        grams = sorted(trigrams(normalize(name)))
+        forward.append(grams)
+        for gram in grams:
+            postings[gram].append(name_id)
+
+    encoded = [n.encode("utf-8") for n in names]
+    name_offsets = [0]
+    for e in encoded:
+        name_offsets.append(name_offsets[-1] + len(e))
+    blob = b"".join(encoded)
+    blob += b"\0" * (-len(blob) % 4)
+    gram_offsets = [0]
+    for grams in forward:
+        gram_offsets.append(gram_offsets[-1] + len(grams))
+    gram_blob = _native(chain.from_iterable(forward), "H")
+    gram_blob += b"\0" * (-len(gram_blob) % 4)
+    post_offsets = [0]
+    for p in postings:
+        post_offsets.append(post_offsets[-1] + len(p))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(_native([len(names), len(blob)]))
+        f.write(_native(name_offsets))
+        f.write(blob)
+        f.write(_native(gram_offsets))
+        f.write(gram_blob)
+        f.write(_native(post_offsets))
+        f.write(_native(chain.from_iterable(postings)))
+    os.replace(tmp, path)
+    return len(names)
+
+
+class DrugIndex:
+    """Read-only, memory-mapped trigram index (see build_index)."""
+
+    def __init__(self, path=DRUG_INDEX_PATH):
+        if sys.byteorder != "little":
+            raise RuntimeError("drug name index is little-endian only")
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"{path} is not a drug name index")
+        self.size, names_bytes = view[8:16].cast("I")
+        pos = 16
+        self._name_offsets = view[pos:pos + 4 * (self.size + 1)].cast("I")
+        pos += 4 * (self.size + 1)
+        self._names = view[pos:pos + names_bytes]
+        pos += names_bytes
+        self._gram_offsets = view[pos:pos + 4 * (self.size + 1)].cast("I")
+        pos += 4 * (self.size + 1)
+        gram_count = self._gram_offsets[self.size]
+        self._grams = view[pos:pos + 2 * gram_count].cast("H")
+        pos += 2 * gram_count + (-2 * gram_count % 4)
+        self._post_offsets = view[pos:pos + 4 * (GRAMS + 1)].cast("I")
+        pos += 4 * (GRAMS + 1)
+        self._postings = view[pos:].cast("I")
+
+    def name(self, name_id):
+        return bytes(self._names[self._name_offsets[name_id]:self._name_offsets[name_id + 1]]).decode("utf-8")
+
+    def _posting(self, gram):
+        return self._postings[self._post_offsets[gram]:self._post_offsets[gram + 1]]
+
+    def match(self, name, k=5):
+        """Top-k formulary names for name as [(name, score)], score = trigram Dice in [0, 1]."""
+        query = normalize(name)
+        if not query:
+            return []
+        grams = trigrams(query)
+        offsets = self._post_offsets
+        seeds, budget = [], POSTINGS_BUDGET
+        for gram in sorted(grams, key=lambda g: offsets[g + 1] - offsets[g]):
+            length = offsets[gram + 1] - offsets[gram]
+            if len(seeds) >= MIN_SEED_GRAMS and length > budget:
+                break
+            seeds.append(gram)
+            budget -= length
+        hits = Counter(chain.from_iterable(self._posting(g) for g in seeds))
+
+        # Only the names sharing the most seed trigrams are scored exactly
+        candidates = sorted(hits, key=hits.__getitem__, reverse=True)[:CANDIDATES]
+
+        scored = []
+        size = len(grams)
+        gram_offsets = self._gram_offsets
+        for name_id in candidates:
+            start, end = gram_offsets[name_id], gram_offsets[name_id + 1]
+            shared = len(grams.intersection(self._grams[start:end]))
+            scored.append((2 * shared / (size + end - start), name_id))
+        top = sorted(scored, key=lambda s: -s[0])[:k]
+        return [(self.name(name_id), round(score, 3)) for score, name_id in top]
+
+    def close(self):
+        # Release the typed views first; mmap refuses to close while they exist
+        del self._name_offsets, self._names, self._gram_offsets, self._grams, self._post_offsets, self._postings
+        self._mmap.close()
+        self._file.close()
+
+
+_default = None
+
+
+def default_index():
+    """The index at DRUG_INDEX_PATH, opened once; None when no index has been built."""
+    global _default
+    if _default is None and os.path.exists(DRUG_INDEX_PATH):
+        _default = DrugIndex(DRUG_INDEX_PATH)
+    return _default
+
+
+def _synthetic_names(count, seed=7):
+    """Pronounceable drug-like names: random consonant-vowel syllables plus common suffixes."""
+    rng = random.Random(seed)
+    consonants, vowels = "bcdfgklmnprstvxz", "aeiou"
+    suffixes = ["", "", "ine", "ol", "in", "ide", "ate", "one", "pril", "sartan", "statin", "mab", "cillin", "azole"]
+    names = set()
+    while len(names) < count:
+        stem = "".join(rng.choice(consonants) + rng.choice(vowels) + rng.choice(["", "", rng.choice(consonants)])
+                       for _ in range(rng.randint(2, 3)))
+        names.add((stem + rng.choice(suffixes)).capitalize())
+    return sorted(names)
+
+
+def _misspell(name, rng):
+    chars = list(name.lower())
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.choice("sdi")
+        if op == "s":
+            chars[i] = rng.choice("abcdefghijklmnopqrstuvwxyz")
+        elif op == "d" and len(chars) > 4:
+            del chars[i]
+        else:
+            chars.insert(i, rng.choice("abcdefghijklmnopqrstuvwxyz"))
+    return "".join(chars)
+
+
+def _bench(count, queries, path):
+    names = _synthetic_names(count)
+    started = time.perf_counter()
+    build_index(names, path)
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = DrugIndex(path)
+    loaded = time.perf_counter() - started
+
+    rng = random.Random(11)
+    targets = [rng.choice(names) for _ in range(queries)]
+    latencies, found = [], 0
+    for target in targets:
+        query = _misspell(target, rng)
+        started = time.perf_counter()
+        result = index.match(query)
+        latencies.append(time.perf_counter() - started)
+        found += any(candidate == target for candidate, _ in result)
+    latencies.sort()
+
+    def pct(p):
+        return 1e6 * latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    print(f"names: {index.size}  index: {os.path.getsize(path) / 1e6:.1f} MB  "
+          f"build: {built:.2f}s  load (mmap): {1000 * loaded:.2f} ms")
+    print(f"{queries} misspelled queries: p50 {pct(0.5):.0f} µs  p95 {pct(0.95):.0f} µs  "
+          f"p99 {pct(0.99):.0f} µs  target in top 5: {100 * found / queries:.1f}%")
+    index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzzy drug-name index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build the index from a formulary (one name per line)")
+    build.add_argument("formulary")
+    build.add_argument("--index", default=DRUG_INDEX_PATH)
+    match = sub.add_parser("match", help="look up a name")
+    match.add_argument("name")
+    match.add_argument("--index", default=DRUG_INDEX_PATH)
+    bench = sub.add_parser("bench", help="benchmark on a synthetic formulary")
+    bench.add_argument("--names", type=int, default=100000)
+    bench.add_argument("--queries", type=int, default=2000)
+    bench.add_argument("--index", default=os.path.join(os.path.dirname(DRUG_INDEX_PATH), "drug_names_bench.idx"))
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.formulary, encoding="utf-8") as f:
+            print(f"✅ Indexed {build_index(f, args.index)} names into {args.index}")
+    elif args.command == "match":
+        for candidate, score in DrugIndex(args.index).match(args.name):
+            print(f"{score:.3f}  {candidate}")
+    else:
+        _bench(args.names, args.queries, args.index)
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# SQLite file shared by every worker process on this host
+CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "extraction_cache.db")
+)
+CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_MAX_AGE_SECONDS = int(os.getenv("EXTRACTION_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+
+
+def image_sha256(image_bytes):
+    """Hex SHA-256 of the raw image bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def cache_key(image_hash, prompt_version):
+    """Cache key = prompt version + content hash, so a prompt change never reuses stale output."""
+    return f"{prompt_version}:{image_hash}"
+
+
+class ExtractionCache:
+    """
+    Persistent LRU cache of model extraction results.
+    - Backed by SQLite in WAL mode so several Flask workers can share it.
+    - Bounded by entry count, total payload bytes and entry age.
+    - Values are JSON-serialisable objects (the parsed model items).
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, max_age_seconds=CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_last_access ON extractions(last_access)")
+        conn.commit()
+
+    def _conn(self):
+        # sqlite3 connections must not be shared across threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss / expired entry."""
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, created_at FROM extractions WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if now - created_at > self.max_age_seconds:
+            conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE extractions SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return json.loads(value)
+
+    def put(self, key, value):
+        """Store value under key and evict least-recently-used entries past the bounds."""
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO extractions (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload.encode("utf-8")), now, now)
+        )
+        self._evict(conn, now)
+        conn.commit()
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM extractions WHERE created_at < ?", (now - self.max_age_seconds,))
+
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # Walk entries from least to most recently used until both bounds hold
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM extractions ORDER BY last_access ASC"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            count -= 1
+            total -= size
+        conn.executemany("DELETE FROM extractions WHERE key = ?", doomed)
+
+    def stats(self):
+        """Entry count and payload size, for diagnostics."""
+        count, total = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions"
+        ).fetchone()
+        return {"entries": count, "bytes": total,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
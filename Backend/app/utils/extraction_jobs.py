@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Extraction concurrency: how many model calls may be in flight per process
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "4"))
+# Jobs accepted but not yet finished; beyond this, submissions are rejected
+EXTRACTION_QUEUE_MAX = int(os.getenv("EXTRACTION_QUEUE_MAX", "100"))
+# "sqlite" shares job status across worker processes; "memory" is process-local
+JOB_BACKEND = os.getenv("JOB_BACKEND", "sqlite")
+JOB_DB_PATH = os.getenv(
+    "JOB_DB_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "jobs.db")
+)
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class QueueFull(Exception):
+    """Raised when the extraction queue is at EXTRACTION_QUEUE_MAX."""
+
+
+class MemoryJobStore:
+    """Process-local job status, suitable for a single worker and for tests."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def create(self, job_id):
+        now = time.time()
+        with self._cond:
+            self._jobs[job_id] = {"id": job_id, "status": PENDING, "result": None,
+                                  "error": None, "created_at": now, "updated_at": now}
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(status=status, result=result, error=error, updated_at=time.time())
+            self._cond.notify_all()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id, timeout):
+        """Block until the job finishes or timeout elapses; returns the job."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] in FINISHED:
+                    return dict(job) if job else None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def purge(self, older_than):
+        with self._cond:
+            for job_id in [j for j, job in self._jobs.items()
+                           if job["status"] in FINISHED and job["updated_at"] < older_than]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job status in SQLite so any worker process can answer GET /api/jobs/<id>."""
+
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (id, status, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (job_id, PENDING, now, now)
+        )
+        conn.commit()
+
+    def update(self, job_id, status, result=None, error=None):
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+             error, time.time(), job_id)
+        )
+        conn.commit()
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            "SELECT id, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "status": row[1],
+                "result": json.loads(row[2]) if row[2] else None,
+                "error": row[3], "created_at": row[4], "updated_at": row[5]}
+
+    def wait(self, job_id, timeout):
+        # Another process may run the job, so there is nothing to block on but the table
+        deadline = time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINISHED or time.time() >= deadline:
+                return job
+            time.sleep(self.POLL_INTERVAL)
+
+    def purge(self, older_than):
+        conn = self._conn()
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, older_than)
+        )
+        conn.commit()
+
+
+class JobQueue:
+    """
+    Bounded pool running extraction jobs off the request thread.
+    - max_workers caps concurrent model calls
+    - max_pending caps accepted-but-unfinished jobs (QueueFull beyond it)
+    """
+
+    def __init__(self, store=None, max_workers=EXTRACTION_WORKERS, max_pending=EXTRACTION_QUEUE_MAX):
+        if store is None:
+            store = SQLiteJobStore() if JOB_BACKEND == "sqlite" else MemoryJobStore()
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extract")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs); its return value becomes the job result. Returns the job id."""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull(f"Extraction queue is full ({self.max_pending} jobs pending)")
+
+        job_id = uuid.uuid4().hex
+        try:
+            self.store.purge(time.time() - JOB_TTL_SECONDS)
+            self.store.create(job_id)
+            self._executor.submit(self._run, job_id, fn, args, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        try:
+            self.store.update(job_id, RUNNING)
+            result = fn(*args, **kwargs)
+            self.store.update(job_id, DONE, result=result)
+        except Exception as e:
+            print(f"❌ Extraction job {job_id} failed: {e}")
+            self.store.update(job_id, FAILED, error=str(e))
+        finally:
+            self._slots.release()
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout):
+        return self.store.wait(job_id, timeout)
@@ -0,0 +1,108 @@
+import io
+import os
+
+from PIL import Image, ImageOps, features
+
+from db_utils import fs, open_prescription_image
+
+# Longest side of the image sent to the model; handwriting stays legible well below camera resolution
+MODEL_INPUT_MAX_SIDE = int(os.getenv("MODEL_INPUT_MAX_SIDE", "1600"))
+MODEL_INPUT_QUALITY = int(os.getenv("MODEL_INPUT_QUALITY", "85"))
+
+# Longest side of the history-view thumbnail
+THUMBNAIL_MAX_SIDE = int(os.getenv("THUMBNAIL_MAX_SIDE", "320"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "70"))
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+VARIANTS = ("thumb", "model")
+
+
+def _load(image_bytes):
+    """Decode, apply EXIF rotation and flatten to RGB. Returns (image, source format)."""
+    img = Image.open(io.BytesIO(image_bytes))
+    fmt = img.format
+    # Phone photos carry their rotation in EXIF; bake it in before resizing
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return img, fmt
+
+
+def _encode(img, fmt, quality):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def make_thumbnail(image_bytes):
+    """Small WebP (or JPEG) preview. Returns (bytes, mimetype)."""
+    img, _ = _load(image_bytes)
+    img.thumbnail((THUMBNAIL_MAX_SIDE, THUMBNAIL_MAX_SIDE), Image.LANCZOS)
+    return _encode(img, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY), f"image/{THUMBNAIL_FORMAT.lower()}"
+
+
+def make_model_input(image_bytes):
+    """
+    JPEG capped at MODEL_INPUT_MAX_SIDE for the extractor.
+    Returns (bytes, mimetype). Small JPEGs are passed through untouched and
+    anything Pillow cannot decode is returned as-is for the model to try.
+    """
+    try:
+        img, fmt = _load(image_bytes)
+    except Exception as e:
+        print(f"Could not decode image for downscaling: {e}")
+        return image_bytes, "image/jpeg"
+
+    if max(img.size) <= MODEL_INPUT_MAX_SIDE and fmt == "JPEG":
+        return image_bytes, "image/jpeg"
+
+    img.thumbnail((MODEL_INPUT_MAX_SIDE, MODEL_INPUT_MAX_SIDE), Image.LANCZOS)
+    out = _encode(img, "JPEG", MODEL_INPUT_QUALITY)
+    # Re-encoding a small, already-compressed image can make it bigger
+    if len(out) >= len(image_bytes) and fmt == "JPEG":
+        return image_bytes, "image/jpeg"
+    return out, "image/jpeg"
+
+
+RENDERERS = {
+    "thumb": make_thumbnail,
+    "model": make_model_input,
+}
+
+
+def store_derivative(original_id, variant, data, mimetype):
+    """Store a derivative in GridFS alongside its original."""
+    return fs.put(
+        data,
+        filename=f"{original_id}.{variant}",
+        derived_from=original_id,
+        variant=variant,
+        content_type=mimetype
+    )
+
+
+def store_derivatives(original_id, derivatives):
+    """
+    derivatives: {variant: (bytes, mimetype)}
+    Variants already stored (e.g. rendered lazily by an early request) are skipped.
+    """
+    for variant, (data, mimetype) in derivatives.items():
+        if fs.find_one({"derived_from": original_id, "variant": variant}) is None:
+            store_derivative(original_id, variant, data, mimetype)
+
+
+def open_image_variant(file_id, variant):
+    """
+    Open a derivative for streaming, rendering and storing it on first access.
+    Records uploaded before derivatives existed are back-filled lazily this way.
+    """
+    original = open_prescription_image(file_id)
+    if variant not in VARIANTS:
+        return original
+
+    existing = fs.find_one({"derived_from": original._id, "variant": variant})
+    if existing is not None:
+        return existing
+
+    data, mimetype = RENDERERS[variant](original.read())
+    return fs.get(store_derivative(original._id, variant, data, mimetype))
@@ -0,0 +1,57 @@
+"""
+One-off import of the medicines_*.json side files in data/ into the
+medicine_files collection.
+
+Usage:
+    python import_medicine_files.py [--data-dir ../data] [--dry-run]
+
+Safe to re-run: documents are upserted by filename. The owner of each file is
+taken from the prescription entry that references it; files no prescription
+references are imported without an email (still downloadable by name, but no
+user's "latest"). created_at is the file's modification time. The files are
+left in place; remove data/ once the import has been checked.
+"""
+import os
+import glob
+import json
+import argparse
+from datetime import datetime
+
+from db_utils import prescriptions, save_medicine_file
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def owner_of(filename):
+    record = prescriptions.find_one({"prescriptions.file": filename}, {"email": 1})
+    return record["email"] if record else None
+
+
+def import_files(data_dir=DEFAULT_DATA_DIR, dry_run=False):
+    imported, orphans = 0, 0
+    for path in sorted(glob.glob(os.path.join(data_dir, "medicines_*.json"))):
+        filename = os.path.basename(path)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Skipping {filename}: {e}")
+            continue
+        email = owner_of(filename)
+        orphans += email is None
+        if not dry_run:
+            save_medicine_file(email, data, filename=filename,
+                               created_at=datetime.fromtimestamp(os.path.getmtime(path)))
+        imported += 1
+
+    verb = "Would import" if dry_run else "Imported"
+    print(f"✅ {verb} {imported} files from {data_dir} ({orphans} not referenced by any prescription)")
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import data/medicines_*.json into the medicine_files collection")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    import_files(args.data_dir, args.dry_run)
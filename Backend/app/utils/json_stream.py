@@ -0,0 +1,91 @@
+"""
+Incremental parser for the model's JSON answer, fed as it streams in.
+
+The answer is {"medicines": [{...}, {...}]} (or a bare [{...}]), possibly wrapped
+in a ```json fence. Every object in the first non-empty array is returned as soon as its
+closing brace arrives, so the caller can act on the first medicine while the
+model is still writing the rest.
+
+    parser = ItemStreamParser()
+    for chunk in response:
+        for item in parser.feed(chunk.text):
+            ...
+    parser.close()  # raises ValueError if no JSON was seen
+
+Only the characters added since the last feed are scanned; string contents
+(including escaped quotes and braces) are skipped correctly.
+"""
+import json
+
+
+class ItemStreamParser:
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        # Depth of the items array once found, and where the current item started
+        self._items_depth = None
+        self._item_start = None
+        self._array_items = 0
+        self.seen_json = False
+        self.items = []
+
+    def feed(self, chunk):
+        """Add streamed text; returns the items completed by it (parsed dicts)."""
+        if not chunk:
+            return []
+        self._buffer += chunk
+        done = []
+        buffer = self._buffer
+        for pos in range(self._pos, len(buffer)):
+            c = buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if not self._stack and c not in "{[":
+                # Fence or commentary around the JSON
+                continue
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self.seen_json = True
+                if c == "[" and self._items_depth is None and len(self._stack) <= 1:
+                    self._items_depth = len(self._stack) + 1
+                elif c == "{" and self._items_depth is not None and len(self._stack) == self._items_depth:
+                    self._item_start = pos
+                self._stack.append(c)
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if c == "}" and self._item_start is not None and len(self._stack) == self._items_depth:
+                    item = json.loads(buffer[self._item_start:pos + 1])
+                    self._item_start = None
+                    if isinstance(item, dict):
+                        done.append(item)
+                        self._array_items += 1
+                elif c == "]" and self._items_depth is not None and len(self._stack) < self._items_depth:
+                    # Items array closed: done, unless it was an empty list before the real one
+                    self._items_depth = -1 if self._array_items else None
+
+        self._pos = len(buffer)
+        # Text before the current item is no longer needed
+        keep = self._item_start if self._item_start is not None else self._pos
+        self._buffer = buffer[keep:]
+        self._pos -= keep
+        if self._item_start is not None:
+            self._item_start = 0
+        self.items.extend(done)
+        return done
+
+    def close(self):
+        """Call once the stream has ended; returns every item parsed."""
+        if not self.seen_json:
+            raise ValueError("Gemini did not return JSON.")
+        return self.items
@@ -0,0 +1,112 @@
+"""
+Server-side expiry of finished medicine courses.
+
+A medicine expires once today is past its end_date. Instead of parsing every
+date in Python, the sweep is a handful of index-backed operations:
+
+1. one aggregation over medicines.end_date finds the affected users and counts
+   their expired entries,
+2. one update_many $pulls the expired entries from those users,
+3. one delete_many drops users left with no medicines.
+
+Dates must be BSON dates for this (string dates sort before every date, so they
+never match); run with --convert-dates once to rewrite documents saved before
+save_medicines stored real dates.
+
+Usage:
+    python medicine_expiry.py [--convert-dates]
+"""
+import argparse
+from datetime import datetime, date
+
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def to_bson_date(value):
+    """'YYYY-MM-DD', date or datetime -> midnight datetime (BSON has no date-only type)."""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def expiry_cutoff(today=None):
+    """Courses whose end_date is before this instant have expired."""
+    return to_bson_date(today or datetime.now().date())
+
+
+def sweep_expired(db, today=None):
+    """Remove expired medicines (and emptied users). Returns counts of what was removed."""
+    medicines = db["medicines"]
+    cutoff = expiry_cutoff(today)
+
+    affected = list(medicines.aggregate([
+        {"$match": {"medicines.end_date": {"$lt": cutoff}}},
+        {"$project": {"expired": {"$size": {"$filter": {
+            "input": "$medicines",
+            # Aggregation compares across types and strings sort before dates: bound both sides
+            "cond": {"$and": [
+                {"$gte": ["$$this.end_date", datetime.min]},
+                {"$lt": ["$$this.end_date", cutoff]},
+            ]},
+        }}}}},
+    ]))
+    if not affected:
+        return {"users": 0, "medicines_removed": 0, "users_deleted": 0}
+
+    ids = [doc["_id"] for doc in affected]
+    medicines.update_many(
+        {"_id": {"$in": ids}},
+        {
+            "$pull": {"medicines": {"end_date": {"$lt": cutoff}}},
+            "$set": {"updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        }
+    )
+    deleted = medicines.delete_many({"_id": {"$in": ids}, "medicines": {"$size": 0}})
+
+    return {
+        "users": len(ids),
+        "medicines_removed": sum(doc["expired"] for doc in affected),
+        "users_deleted": deleted.deleted_count,
+    }
+
+
+def _string_to_date(field):
+    value = f"$$this.{field}"
+    return {"$cond": [
+        {"$eq": [{"$type": value}, "string"]},
+        {"$dateFromString": {"dateString": value, "format": DATE_FORMAT}},
+        value,
+    ]}
+
+
+def convert_string_dates(db):
+    """One-off: rewrite string start_date/end_date values as BSON dates, server-side."""
+    result = db["medicines"].update_many(
+        {"$or": [{"medicines.start_date": {"$type": "string"}}, {"medicines.end_date": {"$type": "string"}}]},
+        [{"$set": {"medicines": {"$map": {
+            "input": "$medicines",
+            "in": {"$mergeObjects": ["$$this", {
+                "start_date": _string_to_date("start_date"),
+                "end_date": _string_to_date("end_date"),
+            }]},
+        }}}}]
+    )
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    from mongo_conn import get_db
+
+    parser = argparse.ArgumentParser(description="Remove expired medicines from every user")
+    parser.add_argument("--convert-dates", action="store_true",
+                        help="first rewrite string dates saved by older versions as BSON dates")
+    args = parser.parse_args()
+
+    db = get_db()
+    if args.convert_dates:
+        print(f"📅 Converted string dates for {convert_string_dates(db)} users")
+    result = sweep_expired(db)
+    print(f"🗑 Removed {result['medicines_removed']} expired medicines from {result['users']} users "
+          f"({result['users_deleted']} users left with none were deleted)")
@@ -0,0 +1,92 @@
+"""
+Move embedded prescription `image_bytes` into GridFS.
+
+Usage:
+    python migrate_images_to_gridfs.py [--batch-size 100] [--dry-run]
+
+Safe to interrupt and re-run:
+- Only entries that still carry binary `image_bytes` are picked up.
+- Each GridFS file is tagged with `migrated_from` ("<email>/<file>"), so an image
+  uploaded before a crash is reused instead of duplicated on the next run.
+"""
+import argparse
+import time
+
+from db_utils import prescriptions, fs, store_image
+
+# Entries still holding an embedded blob
+PENDING = {"prescriptions.image_bytes": {"$type": "binData"}}
+
+
+def migrate_entry(email, entry):
+    """Move one embedded image into GridFS and swap the blob for a reference."""
+    source = f"{email}/{entry['file']}"
+    image_bytes = bytes(entry["image_bytes"])
+
+    existing = fs.find_one({"migrated_from": source})
+    if existing is not None:
+        ref = {
+            "image_file_id": existing._id,
+            "image_size": existing.length,
+            "image_sha256": existing.sha256
+        }
+    else:
+        ref = store_image(image_bytes, image_name=entry.get("image_name"), email=email, migrated_from=source)
+
+    result = prescriptions.update_one(
+        {
+            "email": email,
+            "prescriptions": {"$elemMatch": {"file": entry["file"], "image_bytes": {"$type": "binData"}}}
+        },
+        {
+            "$set": {f"prescriptions.$.{k}": v for k, v in ref.items()},
+            "$unset": {"prescriptions.$.image_bytes": ""}
+        }
+    )
+    return result.modified_count
+
+
+def migrate(batch_size=100, dry_run=False):
+    """
+    Migrate in batches of `batch_size` entries.
+    Each batch fetches at most one pending entry per user document ($elemMatch),
+    so memory stays bounded no matter how large a user's history is.
+    """
+    moved = 0
+    batches = 0
+    started = time.time()
+    while True:
+        cursor = prescriptions.find(
+            PENDING,
+            {"email": 1, "prescriptions": {"$elemMatch": {"image_bytes": {"$type": "binData"}}}}
+        ).limit(batch_size)
+        docs = list(cursor)
+        if not docs:
+            break
+        batches += 1
+
+        if dry_run:
+            remaining = prescriptions.count_documents(PENDING)
+            print(f"🔎 {remaining} user documents still hold embedded images")
+            return 0
+
+        before = moved
+        for doc in docs:
+            for entry in doc.get("prescriptions", []):
+                moved += migrate_entry(doc["email"], entry)
+        if moved == before:
+            print("⚠️ Batch made no progress; stopping so the remaining entries can be inspected")
+            break
+
+        print(f"📦 Batch {batches}: {moved} images moved so far ({time.time() - started:.1f}s)")
+
+    print(f"✅ Migration complete: {moved} images moved to GridFS in {batches} batches")
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded prescription images into GridFS")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    migrate(batch_size=args.batch_size, dry_run=args.dry_run)
@@ -0,0 +1,188 @@
+"""
+Shared MongoDB connection manager for the backend and the reminder service.
+
+One MongoClient (and so one connection pool) per process, configured from the
+environment:
+
+    MONGO_URI                          connection string (default: localhost)
+    MONGO_DB_NAME                      database name (default: medicines_db)
+    MONGO_MAX_POOL_SIZE                max connections per server (default: 100)
+    MONGO_MIN_POOL_SIZE                connections kept warm (default: 0)
+    MONGO_MAX_IDLE_TIME_MS             close idle connections after this long
+    MONGO_WAIT_QUEUE_TIMEOUT_MS        max wait for a free pooled connection
+    MONGO_CONNECT_TIMEOUT_MS           TCP/TLS connect timeout (default: 10000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS  server selection timeout (default: 10000)
+    MONGO_SOCKET_TIMEOUT_MS            per-operation socket timeout
+    MONGO_READ_PREFERENCE              primary | primaryPreferred | secondary | secondaryPreferred | nearest
+    MONGO_WRITE_CONCERN_W              e.g. 1 or majority
+    MONGO_WRITE_CONCERN_J              true/false, wait for the journal
+"""
+import os
+import time
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+
+load_dotenv()
+
+DEFAULT_DB_NAME = os.getenv("MONGO_DB_NAME", "medicines_db")
+
+
+def _int_env(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def client_options():
+    """MongoClient keyword arguments built from the environment."""
+    options = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE", 0),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS", 10000),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000),
+    }
+    optional = {
+        "maxIdleTimeMS": _int_env("MONGO_MAX_IDLE_TIME_MS"),
+        "waitQueueTimeoutMS": _int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "socketTimeoutMS": _int_env("MONGO_SOCKET_TIMEOUT_MS"),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE") or None,
+    }
+    w = os.getenv("MONGO_WRITE_CONCERN_W")
+    if w:
+        optional["w"] = int(w) if w.isdigit() else w
+    j = os.getenv("MONGO_WRITE_CONCERN_J")
+    if j:
+        optional["journal"] = j.lower() in ("1", "true", "yes")
+    options.update({k: v for k, v in optional.items() if v is not None})
+    return options
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts pool events so the pool can be sized from real traffic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.created = 0
+            self.closed = 0
+            self.checked_out = 0
+            self.checked_in = 0
+            self.checkout_failed = 0
+            self.cleared = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+            self._checkout_started = {}
+
+    def _wait_started(self):
+        return self._checkout_started.pop(threading.get_ident(), None)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._checkout_started[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failed += 1
+            self._wait_started()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            started = self._wait_started()
+            if started is not None:
+                waited = time.perf_counter() - started
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_in += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "connections_open": self.created - self.closed,
+                "checked_out_total": self.checked_out,
+                "in_use": self.checked_out - self.checked_in,
+                "checkout_failed": self.checkout_failed,
+                "pool_cleared": self.cleared,
+                "checkout_wait_avg_ms": round(1000 * self.wait_seconds_total / self.checked_out, 3)
+                if self.checked_out else 0.0,
+                "checkout_wait_max_ms": round(1000 * self.wait_seconds_max, 3),
+            }
+
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+pool_listener = PoolStatsListener()
+
+
+def get_client():
+    """The process-wide MongoClient, created on first use (and again after a fork)."""
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(os.getenv("MONGO_URI"), event_listeners=[pool_listener], **client_options())
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_db(name=None):
+    """Database handle on the shared client (MONGO_DB_NAME by default)."""
+    return get_client()[name or DEFAULT_DB_NAME]
+
+
+def pool_stats():
+    """Pool configuration plus event counters since start-up."""
+    options = client_options()
+    stats = pool_listener.snapshot()
+    stats.update({
+        "max_pool_size": options["maxPoolSize"],
+        "min_pool_size": options["minPoolSize"],
+        "wait_queue_timeout_ms": options.get("waitQueueTimeoutMS"),
+        "pid": os.getpid(),
+    })
+    return stats
+
+
+def close_client():
+    """Close the shared client (tests, graceful shutdown)."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+        _client_pid = None
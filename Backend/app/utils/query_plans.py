@@ -0,0 +1,134 @@
+"""
+Query plan check: explain() every query shape the backend and reminder service
+issue, and fail if any of them would scan a whole collection.
+
+Usage:
+    python query_plans.py [--ensure-indexes]
+
+Exits 1 when a query that should be indexed resolves to a COLLSCAN.
+Add an entry to QUERIES whenever a new query shape is introduced.
+"""
+import sys
+import argparse
+from datetime import datetime
+
+from bson import ObjectId
+
+from mongo_conn import get_db
+from db_indexes import ensure_indexes
+
+EMAIL = "explain@example.com"
+FILE = "medicines_explain.json"
+
+QUERIES = [
+    # --- Backend/app (db_utils) ---
+    {"name": "get_prescriptions", "collection": "prescriptions", "op": "find",
+     "filter": {"email": EMAIL}},
+    {"name": "save_prescription (upsert)", "collection": "prescriptions", "op": "update",
+     "filter": {"email": EMAIL}, "update": {"$push": {"prescriptions": {"$each": []}}}, "upsert": True},
+    {"name": "list_prescription_images", "collection": "prescriptions", "op": "aggregate",
+     "pipeline": [{"$match": {"email": EMAIL}}, {"$unwind": "$prescriptions"},
+                  {"$replaceRoot": {"newRoot": "$prescriptions"}}, {"$sort": {"entry_id": -1}}]},
+    {"name": "backfill_entry_ids", "collection": "prescriptions", "op": "find",
+     "filter": {"email": EMAIL, "prescriptions": {"$elemMatch": {"entry_id": {"$exists": False}}}}},
+    {"name": "delete_prescription", "collection": "prescriptions", "op": "findAndModify",
+     "filter": {"email": EMAIL, "prescriptions.file": FILE},
+     "update": {"$pull": {"prescriptions": {"file": FILE}}}},
+    {"name": "prescription by file", "collection": "prescriptions", "op": "find",
+     "filter": {"prescriptions.file": FILE}},
+    {"name": "image derivative lookup", "collection": "fs.files", "op": "find",
+     "filter": {"derived_from": ObjectId(), "variant": "thumb"}},
+    {"name": "latest medicine file", "collection": "medicine_files", "op": "find",
+     "filter": {"email": EMAIL}, "sort": {"created_at": -1}},
+    {"name": "medicine file by name", "collection": "medicine_files", "op": "find",
+     "filter": {"_id": FILE}},
+    {"name": "save_medicines (upsert)", "collection": "medicines", "op": "update",
+     "filter": {"email": EMAIL}, "update": {"$push": {"medicines": {"$each": []}}}, "upsert": True},
+    # --- reminder/app.py ---
+    {"name": "expiry sweep: affected users", "collection": "medicines", "op": "aggregate",
+     "pipeline": [{"$match": {"medicines.end_date": {"$lt": datetime(2000, 1, 1)}}}]},
+    {"name": "expiry sweep: pull", "collection": "medicines", "op": "update",
+     "filter": {"_id": {"$in": [ObjectId()]}},
+     "update": {"$pull": {"medicines": {"end_date": {"$lt": datetime(2000, 1, 1)}}}}},
+    {"name": "reminder: watermark poll", "collection": "medicines", "op": "find",
+     "filter": {"updated_at": {"$gte": "2000-01-01 00:00:00"}}},
+    {"name": "reminder: full reconcile", "collection": "medicines", "op": "find",
+     "filter": {}, "full_scan": True},
+    {"name": "reminder: load shard doses", "collection": "reminder_doses", "op": "find",
+     "filter": {"shard": {"$in": [0, 1]}}},
+    {"name": "reminder: replace user doses", "collection": "reminder_doses", "op": "find",
+     "filter": {"user_id": "0"}},
+    {"name": "reminder: lease progress", "collection": "reminder_leases", "op": "update",
+     "filter": {"owner": "worker"}, "update": {"$set": {"last_fired": None}}},
+    {"name": "reminder: live workers", "collection": "reminder_workers", "op": "find",
+     "filter": {"expires_at": {"$gt": 0}}},
+]
+
+
+def explain(db, query):
+    """Run the explain command for one QUERIES entry (queryPlanner verbosity)."""
+    coll = query["collection"]
+    op = query["op"]
+    if op == "find":
+        cmd = {"find": coll, "filter": query["filter"]}
+        if "sort" in query:
+            cmd["sort"] = query["sort"]
+    elif op == "update":
+        cmd = {"update": coll, "updates": [
+            {"q": query["filter"], "u": query["update"], "upsert": query.get("upsert", False)}
+        ]}
+    elif op == "findAndModify":
+        cmd = {"findAndModify": coll, "query": query["filter"], "update": query["update"]}
+    elif op == "aggregate":
+        cmd = {"aggregate": coll, "pipeline": query["pipeline"], "cursor": {}}
+    else:
+        raise ValueError(f"Unknown op {op!r}")
+    return db.command("explain", cmd, verbosity="queryPlanner")
+
+
+def plan_stages(plan):
+    """Every `stage` name anywhere in an explain document."""
+    stages = []
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            # Rejected plans were not chosen; only the winning plan matters
+            if key != "rejectedPlans":
+                stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def check(db):
+    """Explain every query; returns the names of indexed queries that scan the collection."""
+    failures = []
+    for query in QUERIES:
+        stages = plan_stages(explain(db, query))
+        scans = "COLLSCAN" in stages
+        if scans and query.get("full_scan"):
+            status = "⚪ COLLSCAN (full scan by design)"
+        elif scans:
+            status = "❌ COLLSCAN"
+            failures.append(query["name"])
+        else:
+            status = "✅ " + " > ".join(dict.fromkeys(stages))
+        print(f"{query['name']:<35} {status}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if any app query resolves to a collection scan")
+    parser.add_argument("--ensure-indexes", action="store_true", help="run the index bootstrap first")
+    args = parser.parse_args()
+
+    db = get_db()
+    if args.ensure_indexes:
+        ensure_indexes(db)
+    failures = check(db)
+    if failures:
+        print(f"\n{len(failures)} queries would scan a whole collection: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll indexed queries use an index.")
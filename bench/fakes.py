@@ -0,0 +1,186 @@
+"""
+Local stand-ins for the external services, so both apps can be benchmarked offline.
+
+- FakeGenerativeModel: replaces google.generativeai.GenerativeModel; answers with
+  one of the saved extractions in Backend/app/data after a configurable latency,
+  with usage metadata like the real API. With stream=True the answer arrives in
+  chunks spread over that latency.
+- use_mongomock(): points pymongo.MongoClient at one shared in-memory mongomock
+  client (must run before the apps import mongo_conn). Like a standalone mongod,
+  it has no change streams, so the reminder service falls back to polling.
+- FakeTwilio: a threaded HTTP server speaking just enough of the Messages API
+  for twilio.rest.Client, with configurable latency and 429 rate.
+"""
+import os
+import json
+import glob
+import time
+import random
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "Backend", "app", "data")
+UPLOAD_DIR = os.path.join(ROOT, "Backend", "app", "uploads")
+
+# Gemini bills an image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+
+def sample_extractions():
+    """The saved extraction JSONs in Backend/app/data."""
+    samples = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            samples.append(json.load(f))
+    return samples
+
+
+def sample_images():
+    """Raw bytes of the images in Backend/app/uploads."""
+    images = []
+    for path in sorted(glob.glob(os.path.join(UPLOAD_DIR, "*"))):
+        if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg", ".png"):
+            with open(path, "rb") as f:
+                images.append((os.path.basename(path), f.read()))
+    return images
+
+
+class FakeGenerativeModel:
+    """GenerativeModel look-alike: sleeps latency_ms (+- jitter_ms), then returns a saved extraction."""
+    latency_ms = 500
+    jitter_ms = 200
+    error_rate = 0.0
+    responses = None
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        cls = FakeGenerativeModel
+        with cls._lock:
+            cls.calls += 1
+            data = cls.responses[cls.calls % len(cls.responses)]
+        delay = max(0.0, cls.latency_ms + random.uniform(-cls.jitter_ms, cls.jitter_ms)) / 1000
+        failed = random.random() < cls.error_rate
+
+        text = "```json\n" + json.dumps(data, indent=2) + "\n```"
+        prompt = sum(len(part.get("text", "")) // 4 for part in contents if isinstance(part, dict))
+        prompt += IMAGE_TOKENS * sum(1 for part in contents if isinstance(part, dict) and "inline_data" in part)
+        candidates = len(text) // 4
+        usage = SimpleNamespace(prompt_token_count=prompt, candidates_token_count=candidates,
+                                total_token_count=prompt + candidates)
+        if stream:
+            return FakeStream(text, delay, failed, usage)
+        time.sleep(delay)
+        if failed:
+            raise RuntimeError("503 The model is overloaded. Please try again later.")
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class FakeStream:
+    """Streamed answer: a third of the latency before the first chunk, the rest spread over the chunks."""
+    CHUNK_CHARS = 64
+
+    def __init__(self, text, delay, failed, usage):
+        self._text = text
+        self._delay = delay
+        self._failed = failed
+        self.usage_metadata = usage
+
+    def __iter__(self):
+        chunks = [self._text[i:i + self.CHUNK_CHARS] for i in range(0, len(self._text), self.CHUNK_CHARS)]
+        time.sleep(self._delay / 3)
+        if self._failed:
+            raise RuntimeError("503 The model is overloaded. Please try again later.")
+        for chunk in chunks:
+            time.sleep(2 * self._delay / 3 / len(chunks))
+            yield SimpleNamespace(text=chunk)
+
+
+def fake_genai(latency_ms=500, jitter_ms=200, error_rate=0.0):
+    """A stand-in for the google.generativeai module."""
+    FakeGenerativeModel.latency_ms = latency_ms
+    FakeGenerativeModel.jitter_ms = jitter_ms
+    FakeGenerativeModel.error_rate = error_rate
+    FakeGenerativeModel.responses = sample_extractions() or [{"medicines": []}]
+    return SimpleNamespace(GenerativeModel=FakeGenerativeModel, configure=lambda **kwargs: None)
+
+
+def use_mongomock():
+    """Route every MongoClient to one shared mongomock client."""
+    import pymongo
+    import pymongo.mongo_client
+    import mongomock
+    import mongomock.gridfs
+    from pymongo.errors import OperationFailure
+
+    mongomock.gridfs.enable_gridfs_integration()
+    client = mongomock.MongoClient()
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+    mongomock.collection.Collection.watch = watch
+    pymongo.MongoClient = pymongo.mongo_client.MongoClient = lambda *args, **kwargs: client
+    return client
+
+
+class FakeTwilio:
+    """
+    POST /2010-04-01/Accounts/<sid>/Messages.json -> 201 with a queued message,
+    or 429 for error_rate of the requests. Point a client at it with
+    client.api.base_url = fake.url.
+    """
+
+    def __init__(self, latency_ms=80, jitter_ms=40, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.received = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                time.sleep(max(0.0, fake.latency_ms + random.uniform(-fake.jitter_ms, fake.jitter_ms)) / 1000)
+                with fake._lock:
+                    rejected = random.random() < fake.error_rate
+                    if rejected:
+                        fake.rejected += 1
+                    else:
+                        fake.received += 1
+                if rejected:
+                    status, body = 429, {"code": 20429, "message": "Too Many Requests", "status": 429}
+                else:
+                    status, body = 201, {"sid": f"SM{random.getrandbits(128):032x}", "status": "queued"}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-twilio", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
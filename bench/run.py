@@ -0,0 +1,425 @@
+"""
+Offline benchmark / load test for the backend and the reminder service.
+
+Both apps are loaded in-process against local fakes (see fakes.py): a stub
+Gemini model with configurable latency, mongomock (or a real mongod with
+--mongo-uri) and a fake Twilio HTTP server. No external service is contacted.
+
+Workloads:
+- upload:    POST /api/prescriptions with the images in Backend/app/uploads,
+             from --concurrency clients; --hit-ratio of the requests repeat an
+             already uploaded image (extraction cache hit), the rest are unique.
+- stream:    the same uploads through POST /api/prescriptions/stream (SSE);
+             reports time to the first medicine event next to the full latency.
+- reminders: --users users built from the extractions in Backend/app/data; a full
+             reconcile, then the busiest minute of the day delivered through the
+             real sender pool to the fake Twilio server.
+
+Each run reports p50/p95/p99 latency and throughput and is saved to
+bench/results/<commit>.json, then compared with the previous result file.
+
+Usage:
+    python bench/run.py all
+    python bench/run.py upload [--requests 200] [--concurrency 8] [--model-latency-ms 500]
+    python bench/run.py stream [--requests 200] [--concurrency 8]
+    python bench/run.py reminders [--users 5000] [--twilio-latency-ms 80]
+    python bench/run.py compare [BASE.json] [HEAD.json]
+"""
+import os
+import io
+import sys
+import json
+import glob
+import time
+import queue
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import fakes
+
+ROOT = fakes.ROOT
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Metrics where lower is better; everything else (throughput) is higher-is-better
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms", "seconds")
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds for samples in seconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(1000 * ordered[min(len(ordered) - 1, int(len(ordered) * p))], 2)
+
+    return {"p50_ms": pct(0.5), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+            "mean_ms": round(1000 * sum(ordered) / len(ordered), 2), "max_ms": round(1000 * ordered[-1], 2)}
+
+
+def load_module(name, path):
+    """Import a file under a distinct module name (both services are called app.py)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def prepare(args):
+    """Isolated working directory and fakes; must run before either app is imported."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    for sub in ("uploads", "data", "cache"):
+        os.makedirs(sub, exist_ok=True)
+    os.environ.update({
+        "EXTRACTION_CACHE_PATH": os.path.join(workdir, "cache", "extraction_cache.sqlite3"),
+        "JOB_DB_PATH": os.path.join(workdir, "cache", "jobs.sqlite3"),
+        "GEMINI_API_KEY": "",
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "REMINDER_WORKER_ID": "bench",
+        "WATERMARK_POLL_SECONDS": "3600",
+        "TWILIO_SEND_RATE_PER_SECOND": str(args.send_rate),
+        "TWILIO_SEND_BURST": str(args.send_rate),
+    })
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+        os.environ.setdefault("MONGO_DB_NAME", f"bench_{int(time.time())}")
+    else:
+        fakes.use_mongomock()
+    return workdir
+
+
+def quiet(args):
+    """The apps print per request / per message; keep that out of the report unless --verbose."""
+    return open(os.devnull, "w") if not args.verbose else sys.stdout
+
+
+def unique_variant(image, rng):
+    # Decoders stop at the end-of-image marker, so trailing bytes only change the hash
+    return image + rng.getrandbits(64).to_bytes(8, "little")
+
+
+def load_backend(args):
+    """Backend/app/app.py with the fake model, loaded once per run."""
+    if "backend_app" in sys.modules:
+        return sys.modules["backend_app"]
+    sys.path[:0] = [os.path.join(ROOT, "Backend", "app", "utils"), os.path.join(ROOT, "Backend", "app")]
+    with redirect_stdout(quiet(args)):
+        backend = load_module("backend_app", os.path.join(ROOT, "Backend", "app", "app.py"))
+    backend.genai = fakes.fake_genai(args.model_latency_ms, args.model_jitter_ms, args.model_error_rate)
+    backend.USE_GEMINI = True
+    return backend
+
+
+def upload_workload(args, workload):
+    """Queue of (name, image bytes): --hit-ratio of them repeat an earlier image, the rest are unique."""
+    images = fakes.sample_images()
+    if not images:
+        raise SystemExit(f"No images in {fakes.UPLOAD_DIR}")
+    # Seeded per workload, so a later workload in the same run does not hit the cache of an earlier one
+    rng = random.Random(f"{args.seed}-{workload}")
+    work = queue.Queue()
+    sent = []
+    for i in range(args.requests):
+        if sent and rng.random() < args.hit_ratio:
+            work.put(rng.choice(sent))
+        else:
+            name, image = images[i % len(images)]
+            sent.append((name, unique_variant(image, rng)))
+            work.put(sent[-1])
+    return work
+
+
+def run_clients(args, work, request):
+    """Drain work with --concurrency threads calling request(client, name, image). Returns wall seconds."""
+    backend = load_backend(args)
+
+    def client_loop():
+        client = backend.app.test_client()
+        while True:
+            try:
+                name, image = work.get_nowait()
+            except queue.Empty:
+                return
+            request(client, name, image)
+
+    with redirect_stdout(quiet(args)):
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client_loop) for _ in range(args.concurrency)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        return time.perf_counter() - started
+
+
+def upload_form(name, image):
+    return {"string": "bench@example.com", "file": (io.BytesIO(image), name)}
+
+
+def bench_upload(args):
+    backend = load_backend(args)
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def request(client, name, image):
+        started = time.perf_counter()
+        response = client.post("/api/prescriptions", content_type="multipart/form-data", data=upload_form(name, image))
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    wall = run_clients(args, upload_workload(args, "upload"), request)
+
+    stages = {
+        key[0]: round(1000 * series["sum"] / series["count"], 2)
+        for key, series in backend.UPLOAD_STAGE_SECONDS._values.items() if series["count"]
+    }
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_per_s": round(len(latencies) / wall, 2),
+        "latency": percentiles(latencies),
+        "stage_mean_ms": stages,
+        "cache": {key[0]: value for key, value in backend.EXTRACTION_CACHE._values.items()},
+        "model_tokens": {key[0]: value for key, value in backend.MODEL_TOKENS._values.items()},
+        "model_calls": fakes.FakeGenerativeModel.calls,
+    }
+
+
+def bench_stream(args):
+    first, total, errors = [], [], []
+    lock = threading.Lock()
+
+    def request(client, name, image):
+        started = time.perf_counter()
+        response = client.post("/api/prescriptions/stream", content_type="multipart/form-data",
+                               data=upload_form(name, image), buffered=False)
+        first_at, failed = None, response.status_code != 200
+        for chunk in response.response:
+            if first_at is None and b"event: medicine" in chunk:
+                first_at = time.perf_counter() - started
+            failed = failed or b"event: error" in chunk
+        response.close()
+        elapsed = time.perf_counter() - started
+        with lock:
+            total.append(elapsed)
+            if first_at is not None:
+                first.append(first_at)
+            if failed:
+                errors.append(name)
+
+    wall = run_clients(args, upload_workload(args, "stream"), request)
+    return {
+        "requests": len(total),
+        "errors": len(errors),
+        "throughput_per_s": round(len(total) / wall, 2),
+        "first_medicine": percentiles(first),
+        "latency": percentiles(total),
+    }
+
+
+def seed_users(collection, count, rng):
+    """Users with 1-3 medicines each, drawn from the saved extractions, all active today."""
+    medicines = [m for sample in fakes.sample_extractions() for m in sample.get("medicines", [])]
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    users = []
+    for i in range(count):
+        picked = rng.sample(medicines, min(len(medicines), rng.randint(1, 3)))
+        users.append({
+            "email": f"user{i}@example.com",
+            "number": f"+1555{i:07d}",
+            "medicines": [dict(m, start_date=today - timedelta(days=1), end_date=today + timedelta(days=7))
+                          for m in picked],
+            # Older than the watermark, so the polling fallback leaves them to the timed reconcile
+            "updated_at": "2000-01-01 00:00:00",
+        })
+    for start in range(0, len(users), 1000):
+        collection.insert_many(users[start:start + 1000])
+
+
+def bench_reminders(args):
+    sys.path.insert(0, os.path.join(ROOT, "reminder"))
+    twilio = fakes.FakeTwilio(args.twilio_latency_ms, args.twilio_jitter_ms, args.twilio_error_rate).start()
+    with redirect_stdout(quiet(args)):
+        reminder = load_module("reminder_app", os.path.join(ROOT, "reminder", "app.py"))
+    # Minutes are fired explicitly below, never by the wall clock
+    reminder.scheduler.pause()
+    reminder.client.api.base_url = twilio.url
+
+    seed_users(reminder.users_collection, args.users, random.Random(args.seed))
+    with redirect_stdout(quiet(args)):
+        with reminder.state_lock:
+            reminder.last_user_state.clear()
+        started = time.perf_counter()
+        reminder.schedule_all_reminders()
+        reconcile = time.perf_counter() - started
+
+    # The busiest minute of the day is the one that matters for delivery
+    peak_slot = max(range(24 * 60), key=lambda slot: len(reminder.dose_wheel.due(slot)))
+    fire_time = datetime.now().replace(hour=peak_slot // 60, minute=peak_slot % 60, second=0, microsecond=0)
+    started = time.perf_counter()
+    doses = reminder.dispatcher.doses_for(fire_time)
+    select = time.perf_counter() - started
+
+    latencies, outcomes = [], {"sent": 0, "retried": 0, "dead": 0}
+    done = threading.Event()
+    original = reminder.sender.on_outcome
+
+    def on_outcome(outcome, latency):
+        original(outcome, latency)
+        outcomes[outcome] += 1
+        if latency is not None:
+            latencies.append(latency)
+        if outcomes["sent"] + outcomes["dead"] >= len(doses):
+            done.set()
+
+    reminder.sender.on_outcome = on_outcome
+    with redirect_stdout(quiet(args)):
+        started = time.perf_counter()
+        reminder.send_dose_batch(doses, datetime.now())
+        completed = done.wait(args.timeout)
+        wall = time.perf_counter() - started
+    twilio.stop()
+
+    return {
+        "users": args.users,
+        "doses_scheduled": len(reminder.dose_wheel),
+        "reconcile": {"seconds": round(reconcile, 3), "users_per_s": round(args.users / reconcile, 1)},
+        "peak_minute": {
+            "slot": f"{peak_slot // 60:02d}:{peak_slot % 60:02d}",
+            "doses": len(doses),
+            "select_ms": round(1000 * select, 2),
+            "completed": completed,
+            "seconds": round(wall, 3),
+            "throughput_per_s": round(outcomes["sent"] / wall, 2),
+            "outcomes": outcomes,
+            "delivery_latency": percentiles(latencies),
+        },
+        "twilio": {"received": twilio.received, "rejected": twilio.rejected},
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=ROOT, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def save_results(results, params):
+    """Write (or merge into) bench/results/<commit>[-dirty].json. Returns its path."""
+    commit, dirty = git_revision()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{commit}{'-dirty' if dirty else ''}.json")
+    record = {"results": {}, "params": {}}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            record = json.load(f)
+    record.update(commit=commit, dirty=dirty, timestamp=datetime.now().isoformat(timespec="seconds"),
+                  python=platform.python_version(), machine=platform.machine())
+    for workload, result in results.items():
+        record["results"][workload] = result
+        record["params"][workload] = params
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    return path
+
+
+def flatten(value, prefix=""):
+    if isinstance(value, dict):
+        out = {}
+        for key, inner in value.items():
+            out.update(flatten(inner, f"{prefix}.{key}" if prefix else key))
+        return out
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(base_path, head_path):
+    """Print every numeric metric of two result files side by side, flagging >10% regressions."""
+    with open(base_path, encoding="utf-8") as f:
+        base = flatten(json.load(f)["results"])
+    with open(head_path, encoding="utf-8") as f:
+        head = flatten(json.load(f)["results"])
+    print(f"\n{'metric':<52} {os.path.basename(base_path):>16} {os.path.basename(head_path):>16}   change")
+    for key in sorted(set(base) & set(head)):
+        old, new = base[key], head[key]
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change > 10 if key.endswith(LOWER_IS_BETTER) else change < -10
+        watched = key.endswith(LOWER_IS_BETTER) or key.endswith("_per_s")
+        flag = "  ⚠️ regression" if watched and worse else ""
+        print(f"{key:<52} {old:>16} {new:>16} {change:+8.1f}%{flag}")
+
+
+def previous_result(exclude):
+    paths = [p for p in glob.glob(os.path.join(RESULTS_DIR, "*.json")) if os.path.abspath(p) != os.path.abspath(exclude)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the backend and reminder service")
+    parser.add_argument("workload", choices=["all", "upload", "stream", "reminders", "compare"])
+    parser.add_argument("files", nargs="*", help="compare: BASE.json [HEAD.json]")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--hit-ratio", type=float, default=0.3)
+    parser.add_argument("--model-latency-ms", type=float, default=500)
+    parser.add_argument("--model-jitter-ms", type=float, default=200)
+    parser.add_argument("--model-error-rate", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--send-rate", type=float, default=80, help="TWILIO_SEND_RATE_PER_SECOND for the sender")
+    parser.add_argument("--twilio-latency-ms", type=float, default=80)
+    parser.add_argument("--twilio-jitter-ms", type=float, default=40)
+    parser.add_argument("--twilio-error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the peak minute to drain")
+    parser.add_argument("--mongo-uri", help="use this mongod instead of mongomock (a throwaway database is created)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="keep the apps' own output")
+    args = parser.parse_args()
+
+    if args.workload == "compare":
+        head = args.files[1] if len(args.files) > 1 else None
+        if head is None:
+            paths = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), key=os.path.getmtime)
+            head = paths[-1] if paths else None
+        base = args.files[0] if args.files else (previous_result(head) if head else None)
+        if not base or not head:
+            raise SystemExit(f"Need two result files in {RESULTS_DIR} (or pass them)")
+        compare(base, head)
+        return
+
+    prepare(args)
+    results = {}
+    if args.workload in ("all", "upload"):
+        results["upload"] = bench_upload(args)
+    if args.workload in ("all", "stream"):
+        results["stream"] = bench_stream(args)
+    if args.workload in ("all", "reminders"):
+        results["reminders"] = bench_reminders(args)
+    print(json.dumps(results, indent=2))
+
+    if not args.no_save:
+        params = {k: v for k, v in vars(args).items() if k not in ("workload", "files", "no_save", "verbose")}
+        path = save_results(results, params)
+        print(f"💾 Saved {path}")
+        base = previous_result(path)
+        if base:
+            compare(base, path)
+
+
+if __name__ == "__main__":
+    main()
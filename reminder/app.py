@@ -1,13 +1,28 @@
-from flask import Flask
-from pymongo import MongoClient
+from flask import Flask, jsonify, Response
 from apscheduler.schedulers.background import BackgroundScheduler
 from twilio.rest import Client
 from datetime import datetime, date, timedelta
+from pymongo.errors import OperationFailure, PyMongoError
 import os
+import sys
+import time
+import atexit
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Shared backend helpers (Mongo connection manager)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Backend", "app", "utils"))
+from mongo_conn import get_db, pool_stats
+from db_indexes import ensure_indexes
+from medicine_expiry import sweep_expired
+from dose_wheel import DoseWheel, DoseDispatcher, minute_of_day
+from dispatch import ReminderSender
+from schedule_store import ScheduleStore, medicines_fingerprint
+from sharding import LeaseManager, SentLog, claim_worker_id, shard_of
+import metrics
+
 app = Flask(__name__)
 
 # Twilio credentials
@@ -16,139 +31,414 @@ TWILIO_AUTH = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_WHATSAPP = "whatsapp:+14155238886"  # Twilio sandbox number
 client = Client(TWILIO_SID, TWILIO_AUTH)
 
-# MongoDB setup
-MONGO_URI = os.getenv("MONGO_URI")
-mongo_client = MongoClient(MONGO_URI)
-db = mongo_client["medicines_db"]
+# MongoDB setup (shared, pooled client)
+db = get_db()
+# Unique per process: two workers sharing an id would both hold every shard
+WORKER_ID = claim_worker_id(db)
 users_collection = db["medicines"]
+dead_letters_collection = db["reminder_dead_letters"]
+# Durable schedule: persisted doses, per-user fingerprints, this worker's progress
+store = ScheduleStore(db, meta_id=f"worker:{WORKER_ID}")
+# Idempotency keys: each dose goes out once per day across all workers
+sent_log = SentLog(db)
+
+try:
+    ensure_indexes(db)
+except Exception as e:
+    print(f"⚠️ Could not ensure MongoDB indexes: {e}")
 
 # Scheduler
 scheduler = BackgroundScheduler()
 scheduler.start()
 
-# Track last scheduled state per user
+# Reminders go out this many minutes before the dose time
+REMINDER_LEAD_MINUTES = 1
+
+# Doses that fell due while the service was down (or stalled):
+#   skip   - drop them
+#   window - send the ones missed within the last REMINDER_CATCHUP_MINUTES
+#   all    - send everything missed since the last fired minute (up to a day)
+REMINDER_CATCHUP = os.getenv("REMINDER_CATCHUP", "window")
+REMINDER_CATCHUP_MINUTES = int(os.getenv("REMINDER_CATCHUP_MINUTES", "30"))
+CATCHUP_LIMITS = {"skip": 0, "window": REMINDER_CATCHUP_MINUTES, "all": 24 * 60}
+
+# All doses live in one minute-bucketed wheel, fired by a single per-minute job
+dose_wheel = DoseWheel()
+
+# ---------- Metrics (exposed on /metrics) ----------
+TICK_SECONDS = metrics.Histogram("reminder_tick_seconds", "Duration of one dispatcher tick")
+DOSES_DUE = metrics.Counter("reminder_doses_due_total", "Doses fired by the dispatcher, by claim result", ["result"])
+SENDS = metrics.Counter("reminder_sends_total", "Delivery attempt outcomes", ["outcome"])
+DELIVERY_LATENCY = metrics.Histogram("reminder_delivery_latency_seconds",
+                                     "Actual send time minus intended send time",
+                                     buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+SYNC_SECONDS = metrics.Histogram("reminder_sync_seconds", "Duration of schedule syncs", ["kind"])
+CHANGES = metrics.Counter("reminder_changes_total", "Change-stream events (and users re-read by watermark polls) applied", ["operation"])
+metrics.Gauge("reminder_doses_scheduled", "Daily doses in this worker's wheel", function=lambda: len(dose_wheel))
+metrics.Gauge("reminder_shards_owned", "Shards leased by this worker", function=lambda: len(leases.owned))
+
+
+def record_send_outcome(outcome, latency):
+    SENDS.inc(outcome=outcome)
+    if latency is not None:
+        DELIVERY_LATENCY.observe(latency)
+
+
+# Fingerprint of the medicines each user's doses were built from (mirrors reminder_state)
 last_user_state = {}
+# Guards last_user_state: the change watcher and the reconcile job run on different threads
+state_lock = threading.RLock()
 
 
 def medicine_reminder(to_number, name, notes, scheduled_time):
-    """Send WhatsApp reminder."""
-    try:
-        message = client.messages.create(
-            from_=TWILIO_WHATSAPP,
-            body=f"💊 Reminder: At {scheduled_time}, you need to take *{name}*.\nNotes: {notes}",
-            to=to_number
-        )
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Reminder sent for {name} to {to_number} (scheduled for {scheduled_time})")
-    except Exception as e:
-        print(f"❌ Failed to send reminder for {name} to {to_number}: {e}")
-
-
-def schedule_all_reminders():
-    """Schedule reminders for all users and clean up expired medicines and empty users."""
-    global last_user_state
-    today = datetime.now().date()
-    now = datetime.now()
-    users = list(users_collection.find({}))
-
-    for user in users:
-        user_id = str(user["_id"])
-        current_medicines = user.get("medicines", [])
-
-        # Remove expired medicines
-        updated_medicines = []
-        for med in current_medicines:
-            med_name = med["name"]
-            start_date = datetime.strptime(med["start_date"], "%Y-%m-%d").date()
-            end_date = datetime.strptime(med["end_date"], "%Y-%m-%d").date()
-
-            if today > end_date:
-                print(f"🗑 Removing expired medicine {med_name} for {user.get('email')}")
-                users_collection.update_one(
-                    {"_id": user["_id"]},
-                    {"$pull": {"medicines": {"name": med_name}}}
-                )
+    """Send WhatsApp reminder. Raises on failure so the sender can retry."""
+    message = client.messages.create(
+        from_=TWILIO_WHATSAPP,
+        body=f"💊 Reminder: At {scheduled_time}, you need to take *{name}*.\nNotes: {notes}",
+        to=to_number
+    )
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] ✅ Reminder sent for {name} to {to_number} (scheduled for {scheduled_time})")
+    return message
+
+
+def send_dose(dose):
+    medicine_reminder(dose["to"], dose["name"], dose["notes"], dose["time"])
+
+
+def record_dead_letter(dose, error, attempts):
+    """Keep undeliverable reminders for inspection / manual resend."""
+    dead_letters_collection.insert_one({
+        "user_id": dose["user_id"],
+        "to": dose["to"],
+        "name": dose["name"],
+        "notes": dose["notes"],
+        "time": dose["time"],
+        "error": error,
+        "attempts": attempts,
+        "failed_at": datetime.now()
+    })
+
+
+# Concurrent, rate-limited delivery with retries (see dispatch.py for the knobs)
+sender = ReminderSender(send_dose, dead_letter=record_dead_letter, on_outcome=record_send_outcome)
+
+
+def send_dose_batch(doses, fire_time):
+    """Hand every reminder that is due in one minute bucket (and not sent yet) to the sender pool."""
+    dose_date = (fire_time + timedelta(minutes=REMINDER_LEAD_MINUTES)).date()
+    claimed = sent_log.claim(doses, dose_date)
+    DOSES_DUE.inc(len(claimed), result="claimed")
+    if len(claimed) < len(doses):
+        DOSES_DUE.inc(len(doses) - len(claimed), result="already_sent")
+    print(f"[{fire_time.strftime('%H:%M')}] 📤 {len(claimed)} reminders due"
+          + (f" ({len(doses) - len(claimed)} already sent)" if len(claimed) < len(doses) else ""))
+    sender.submit_batch(claimed, fire_time)
+
+
+def record_progress(minute):
+    store.set_meta(last_fired=minute)
+    leases.record_progress(minute)
+
+
+dispatcher = DoseDispatcher(
+    dose_wheel, send_dose_batch,
+    lead_minutes=REMINDER_LEAD_MINUTES,
+    max_catch_up_minutes=CATCHUP_LIMITS.get(REMINDER_CATCHUP, REMINDER_CATCHUP_MINUTES),
+    on_fired=record_progress
+)
+
+
+def unschedule_user(user_id):
+    """Remove every scheduled dose for a user and forget its state."""
+    dose_wheel.cancel_user(user_id)
+    if last_user_state.pop(user_id, None) is not None:
+        store.delete_user(user_id)
+
+
+def to_date(value):
+    """Medicine dates are BSON dates; documents saved by older versions still hold 'YYYY-MM-DD'."""
+    if isinstance(value, datetime):
+        return value.date()
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def sync_user(user):
+    """
+    Bring one user's reminders in line with their medicines document.
+    Doses are only touched when the user's medicines actually changed. Expired
+    medicines are removed by the daily sweep (run_expiry_sweep); until then the
+    dispatcher skips them because it checks each course's dates when firing.
+    """
+    user_id = str(user["_id"])
+    medicines = user.get("medicines", [])
+
+    if not medicines:
+        unschedule_user(user_id)
+        return
+
+    # Skip if medicines have not changed
+    fingerprint = medicines_fingerprint(medicines)
+    if last_user_state.get(user_id) == fingerprint:
+        return
+
+    # Doses recur daily in their minute slot; the dispatcher checks each course's dates when firing.
+    # Keyed by dose key: the same medicine at the same time listed twice (e.g. a prescription
+    # saved twice) is one reminder, the later entry wins.
+    doses = {}
+    for med in medicines:
+        med_name = med["name"]
+        start_date = to_date(med["start_date"])
+        end_date = to_date(med["end_date"])
+        for t in med.get("time", []):
+            doses[f"{user_id}_{med_name}_{t}"] = (minute_of_day(t, REMINDER_LEAD_MINUTES), {
+                "user_id": user_id,
+                "to": f"whatsapp:{user.get('number')}",
+                "name": med_name,
+                "notes": med.get("notes", ""),
+                "time": t,
+                "start_date": start_date,
+                "end_date": end_date
+            })
+    doses = [(key, slot, dose) for key, (slot, dose) in doses.items()]
+
+    # Persist first, then swap the user's doses in the wheel
+    store.save_user(user_id, fingerprint, doses, shard=shard_of(user_id))
+    dose_wheel.cancel_user(user_id)
+    for key, slot, dose in doses:
+        dose_wheel.add(key, slot, dose)
+    print(f"⏰ Scheduled {len(doses)} daily doses for {user.get('email')} ({REMINDER_LEAD_MINUTES} min before each time)")
+
+    # Update last scheduled state
+    last_user_state[user_id] = fingerprint
+
+
+def schedule_all_reminders(shards=None):
+    """
+    Full reconcile: sync every user of this worker's shards (or just `shards`) and
+    drop doses of users that no longer exist.
+    Incremental changes are picked up by watch_medicine_changes; this only runs
+    every RECONCILE_MINUTES, on first start, when the stored change-stream
+    position can no longer be resumed, and for shards taken over from another worker.
+    """
+    shards = set(leases.owned) if shards is None else set(shards)
+
+    with state_lock, SYNC_SECONDS.time(kind="reconcile"):
+        seen = set()
+        for user in users_collection.find({}):
+            user_id = str(user["_id"])
+            if shard_of(user_id) in shards and leases.owns_user(user_id):
+                seen.add(user_id)
+                try:
+                    sync_user(user)
+                except Exception as e:
+                    # One bad document must not stop the rest of the reconcile
+                    print(f"❌ Failed to sync reminders for {user.get('email') or user_id}: {e}")
+
+        for user_id in set(last_user_state) - seen:
+            if shard_of(user_id) in shards:
+                unschedule_user(user_id)
+
+
+# ---------- Incremental sync ----------
+# Full reconcile frequency; incremental sync covers everything in between
+RECONCILE_MINUTES = int(os.getenv("RECONCILE_MINUTES", "60"))
+# Watermark polling interval when change streams are unavailable (standalone mongod)
+WATERMARK_POLL_SECONDS = int(os.getenv("WATERMARK_POLL_SECONDS", "60"))
+
+sync_mode = "starting"
+
+
+def handle_change(change):
+    """Apply one change-stream event to the schedule."""
+    op = change["operationType"]
+    user_id = str(change["documentKey"]["_id"])
+    if not leases.owns_user(user_id):
+        return
+    CHANGES.inc(operation=op)
+    with state_lock, SYNC_SECONDS.time(kind="change"):
+        if op == "delete":
+            unschedule_user(user_id)
+        elif op in ("insert", "update", "replace"):
+            user = change.get("fullDocument")
+            if user is None:
+                # Deleted again before the lookup ran
+                unschedule_user(user_id)
             else:
-                updated_medicines.append(med)
-
-        # Update the medicines list in DB
-        users_collection.update_one(
-            {"_id": user["_id"]},
-            {"$set": {"medicines": updated_medicines}}
-        )
-
-        # If medicines list is empty, remove the user document
-        if not updated_medicines:
-            print(f"🗑 Removing user {user.get('email')} because medicines list is empty")
-            users_collection.delete_one({"_id": user["_id"]})
-            # Remove scheduled jobs for this user
-            if user_id in last_user_state:
-                for med in last_user_state[user_id]:
-                    med_name = med["name"]
-                    for t in med.get("time", []):
-                        job_id = f"{user_id}_{med_name}_{t}"
-                        try:
-                            scheduler.remove_job(job_id)
-                        except:
-                            pass
-                del last_user_state[user_id]
-            continue
-
-        # Skip if medicines have not changed
-        if user_id in last_user_state and last_user_state[user_id] == updated_medicines:
-            continue
-
-        # Remove previously scheduled jobs for this user
-        if user_id in last_user_state:
-            for med in last_user_state[user_id]:
-                med_name = med["name"]
-                for t in med.get("time", []):
-                    job_id = f"{user_id}_{med_name}_{t}"
+                sync_user(user)
+
+
+# InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+RESUME_LOST_CODES = (260, 280, 286)
+
+
+def watch_with_change_stream():
+    """
+    Block on a change stream over the medicines collection, resuming after transient
+    errors. The resume token is persisted, so a restart continues where it stopped.
+    """
+    global sync_mode
+    resume_token = store.get_meta().get("resume_token")
+    reconcile_needed = resume_token is None
+    while True:
+        try:
+            with users_collection.watch(full_document="updateLookup", resume_after=resume_token) as stream:
+                sync_mode = "change_stream"
+                print("👀 Watching medicines collection for changes (change stream)")
+                if reconcile_needed:
+                    # The stream is already open, so nothing written during the reconcile is missed
+                    schedule_all_reminders()
+                    reconcile_needed = False
+                for change in stream:
                     try:
-                        scheduler.remove_job(job_id)
-                    except:
-                        pass
-
-        # Schedule reminders for future medicine times
-        for med in updated_medicines:
-            med_name = med["name"]
-            notes = med.get("notes", "")
-            times = med.get("time", [])
-            start_date = datetime.strptime(med["start_date"], "%Y-%m-%d").date()
-            end_date = datetime.strptime(med["end_date"], "%Y-%m-%d").date()
-
-            if start_date <= today <= end_date:
-                for t in times:
-                    hour, minute = map(int, t.split(":"))
-                    reminder_datetime = datetime.combine(today, datetime.min.time()) + timedelta(hours=hour, minutes=minute)
-                    reminder_datetime -= timedelta(minutes=1)  # 1 min before scheduled time
-
-                    # Only schedule future reminders
-                    if reminder_datetime < now:
-                        continue
-
-                    job_id = f"{user_id}_{med_name}_{t}"
-                    scheduler.add_job(
-                        medicine_reminder,
-                        "cron",
-                        hour=reminder_datetime.hour,
-                        minute=reminder_datetime.minute,
-                        args=[f"whatsapp:{user.get('number')}", med_name, notes, t],
-                        id=job_id,
-                        replace_existing=True
-                    )
-                    print(f"⏰ Scheduled {med_name} for {user.get('email')} at {reminder_datetime.time()} (1 min before {t})")
-
-        # Update last scheduled state
-        last_user_state[user_id] = updated_medicines
-
-
-# Initial scheduling
-schedule_all_reminders()
-
-# Poll DB every 1 minute to pick up changes
-scheduler.add_job(schedule_all_reminders, "interval", minutes=1)
-
-print("✅ WhatsApp medicine reminders scheduler is running (polling every 1 minute)...")
+                        handle_change(change)
+                    except Exception as e:
+                        print(f"❌ Failed to apply change for {change.get('documentKey')}: {e}")
+                    resume_token = stream.resume_token
+                    store.set_meta(resume_token=resume_token)
+        except OperationFailure as e:
+            # Not a replica set: change streams are unavailable, caller falls back to polling
+            if e.code in (40573, 40324) or "replica set" in str(e).lower():
+                return
+            if e.code in RESUME_LOST_CODES:
+                print(f"⚠️ Stored change-stream position is no longer valid, running a full reconcile: {e}")
+                resume_token = None
+                reconcile_needed = True
+                continue
+            print(f"⚠️ Change stream error, resuming: {e}")
+            time.sleep(1)
+        except PyMongoError as e:
+            print(f"⚠️ Change stream error, resuming: {e}")
+            time.sleep(1)
+
+
+def watch_with_watermark():
+    """
+    Fallback: every WATERMARK_POLL_SECONDS, sync only users whose updated_at moved
+    past the last watermark. Deletions are picked up by the periodic full reconcile.
+    """
+    global sync_mode
+    sync_mode = "watermark"
+    print(f"👀 Change streams unavailable; polling updated_at every {WATERMARK_POLL_SECONDS}s")
+    watermark = store.get_meta().get("watermark")
+    if watermark is None:
+        watermark = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        schedule_all_reminders()
+        store.set_meta(watermark=watermark)
+    while True:
+        try:
+            # $gte: writes within the watermark second are re-read; sync_user is a no-op for them
+            with SYNC_SECONDS.time(kind="watermark_poll"):
+                for user in users_collection.find({"updated_at": {"$gte": watermark}}):
+                    watermark = max(watermark, user.get("updated_at") or watermark)
+                    CHANGES.inc(operation="poll")
+                    with state_lock:
+                        try:
+                            sync_user(user)
+                        except Exception as e:
+                            print(f"❌ Failed to sync reminders for {user.get('email') or user['_id']}: {e}")
+            store.set_meta(watermark=watermark)
+        except Exception as e:
+            print(f"⚠️ Watermark poll failed: {e}")
+        time.sleep(WATERMARK_POLL_SECONDS)
+
+
+def watch_medicine_changes():
+    watch_with_change_stream()
+    watch_with_watermark()
+
+
+# ---------- Expiry ----------
+def run_expiry_sweep():
+    """
+    Remove expired medicines for every user in a few server-side operations.
+    The resulting updates reach each shard's owner through the change stream.
+    """
+    started = time.time()
+    result = sweep_expired(db)
+    print(f"🗑 Expiry sweep removed {result['medicines_removed']} medicines from {result['users']} users, "
+          f"deleted {result['users_deleted']} empty users ({time.time() - started:.2f}s)")
+    return result
+
+
+def scheduled_expiry_sweep():
+    # The sweep covers every user, so one worker (the holder of shard 0) runs it
+    if leases.owns(0):
+        run_expiry_sweep()
+
+
+# ---------- Shard ownership ----------
+def shards_gained(shards, takeovers):
+    """
+    Load the persisted doses of newly held shards. Shards taken over from another
+    worker are also reconciled (changes made during the hand-off went unapplied)
+    and their missed minutes replayed from that worker's last fired minute.
+    """
+    started = time.time()
+    with state_lock:
+        last_user_state.update(store.load_fingerprints(shards))
+        for key, slot, dose in store.load_doses(shards):
+            dose_wheel.add(key, slot, dose)
+    print(f"📥 Loaded {len(dose_wheel)} doses for {len(last_user_state)} users in {time.time() - started:.2f}s")
+
+    if takeovers:
+        schedule_all_reminders(takeovers)
+        if REMINDER_CATCHUP != "skip":
+            since = min(takeovers.values())
+            replayed = dispatcher.replay(since, datetime.now(),
+                                         only=lambda d: shard_of(d["user_id"]) in takeovers)
+            print(f"⏪ Replayed {replayed} doses missed on shards {sorted(takeovers)} since {since:%H:%M}")
+
+
+def shards_lost(shards):
+    """Stop firing doses of shards another worker now holds (their persisted state stays)."""
+    with state_lock:
+        for user_id in [u for u in last_user_state if shard_of(u) in shards]:
+            dose_wheel.cancel_user(user_id)
+            del last_user_state[user_id]
+
+
+leases = LeaseManager(db, WORKER_ID, on_gain=shards_gained, on_lose=shards_lost)
+
+
+def load_schedule():
+    """
+    Fast, incremental start-up from the durable schedule: claim shard leases
+    (which reloads their wheel and fingerprints), and pick up the dispatcher
+    where it stopped so missed minutes are replayed per REMINDER_CATCHUP.
+    A full reconcile only happens on first start (triggered by the watcher
+    when no stream position is stored).
+    """
+    last_fired = store.get_meta().get("last_fired")
+    if last_fired is not None and REMINDER_CATCHUP != "skip":
+        dispatcher.last_fired = last_fired
+        missed = int((datetime.now() - last_fired).total_seconds() // 60)
+        if missed > 1:
+            print(f"⏪ {missed} minutes missed since {last_fired:%Y-%m-%d %H:%M}; "
+                  f"catch-up policy '{REMINDER_CATCHUP}' replays up to {dispatcher.max_catch_up_minutes}")
+    leases.rebalance()
+
+
+# Start-up from persisted state
+load_schedule()
+
+# Keep leases renewed (and rebalanced as workers come and go); hand them back on exit
+threading.Thread(target=leases.run, name="shard-leases", daemon=True).start()
+atexit.register(leases.stop)
+
+# Incremental sync in the background, full reconcile at a much lower frequency
+threading.Thread(target=watch_medicine_changes, name="medicine-watch", daemon=True).start()
+scheduler.add_job(schedule_all_reminders, "interval", minutes=RECONCILE_MINUTES)
+# Expired medicines are swept once a day, just after midnight
+scheduler.add_job(scheduled_expiry_sweep, "cron", hour=0, minute=5, id="expiry_sweep")
+# One job fires each minute's whole bucket of doses
+def dispatch_tick():
+    with TICK_SECONDS.time():
+        return dispatcher.tick()
+
+
+scheduler.add_job(dispatch_tick, "cron", second=0, id="dose_dispatcher", max_instances=1, coalesce=True)
+
+print(f"✅ WhatsApp medicine reminders scheduler is running (incremental sync, full reconcile every {RECONCILE_MINUTES} minutes)...")
 
 # Flask endpoints
 @app.route("/")
@@ -158,7 +448,32 @@ def home():
 
 @app.route("/reminders")
 def reminders_status():
-    return "Scheduler is active and sending reminders."
+    return (f"Scheduler is active and sending reminders (worker {WORKER_ID}, shards {sorted(leases.owned)}, "
+            f"sync mode: {sync_mode}, {len(dose_wheel)} daily doses scheduled).")
+
+
+@app.route("/reminders/stats")
+def reminders_stats():
+    """Per-minute delivery counts and latency for the last hour."""
+    return jsonify({"worker": WORKER_ID, "shards": sorted(leases.owned),
+                    "doses_scheduled": len(dose_wheel), "minutes": sender.stats.snapshot()})
+
+
+@app.route("/reminders/sweep", methods=["POST"])
+def reminders_sweep():
+    """Run the expiry sweep now; returns how many medicines and users were removed."""
+    return jsonify(run_expiry_sweep())
+
+
+@app.route("/db/pool")
+def db_pool_status():
+    return jsonify(pool_stats())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's scheduling and delivery metrics."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+"""
+Concurrent, rate-limited WhatsApp reminder delivery.
+
+- A bounded thread pool sends messages in parallel.
+- A token bucket keeps the send rate within the provider's limit.
+- Transient failures (HTTP 429 / 5xx / network errors) are retried with
+  exponential backoff and full jitter; permanent failures and exhausted retries
+  go to a dead-letter sink.
+- Delivery latency (actual send time minus intended send time) is tracked per
+  minute so late delivery at peak minutes is visible.
+
+The actual send is an injected callable, so tests and benchmarks can point it
+at a stub or a fake Twilio server.
+"""
+import os
+import time
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Twilio's default WhatsApp throughput; raise it for approved senders
+SEND_RATE_PER_SECOND = float(os.getenv("TWILIO_SEND_RATE_PER_SECOND", "80"))
+SEND_BURST = int(os.getenv("TWILIO_SEND_BURST", "80"))
+SEND_WORKERS = int(os.getenv("TWILIO_SEND_WORKERS", "16"))
+SEND_MAX_ATTEMPTS = int(os.getenv("TWILIO_SEND_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("TWILIO_RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_SECONDS = float(os.getenv("TWILIO_RETRY_MAX_SECONDS", "60"))
+# Minutes of per-minute latency stats kept in memory
+STATS_MINUTES = 60
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(exc):
+    """Rate limits, server errors and transport errors are worth retrying; other 4xx are not."""
+    status = getattr(exc, "status", None)
+    if status is None:
+        return True
+    return status == 429 or status >= 500
+
+
+def backoff_delay(attempt, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS):
+    """Exponential backoff with full jitter for the given (1-based) attempt."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class LatencyStats:
+    """Per-minute delivery counts and latency summary, keyed by intended send minute."""
+
+    def __init__(self, keep_minutes=STATS_MINUTES):
+        self.keep_minutes = keep_minutes
+        self._minutes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, minute):
+        key = minute.strftime("%Y-%m-%d %H:%M")
+        bucket = self._minutes.get(key)
+        if bucket is None:
+            bucket = self._minutes[key] = {"sent": 0, "retried": 0, "dead": 0, "latencies": []}
+            while len(self._minutes) > self.keep_minutes:
+                self._minutes.popitem(last=False)
+        return bucket
+
+    def record(self, minute, outcome, latency=None):
+        with self._lock:
+            bucket = self._bucket(minute)
+            bucket[outcome] += 1
+            if latency is not None:
+                bucket["latencies"].append(latency)
+
+    def snapshot(self):
+        out = []
+        with self._lock:
+            for key, bucket in self._minutes.items():
+                lat = sorted(bucket["latencies"])
+                out.append({
+                    "minute": key,
+                    "sent": bucket["sent"],
+                    "retried": bucket["retried"],
+                    "dead": bucket["dead"],
+                    "latency_p50_s": round(lat[len(lat) // 2], 3) if lat else None,
+                    "latency_p95_s": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 3) if lat else None,
+                    "latency_max_s": round(lat[-1], 3) if lat else None,
+                })
+        return out
+
+
+class ReminderSender:
+    """
+    Delivery pool for due doses.
+    - send(dose): performs one delivery attempt and raises on failure
+    - dead_letter(dose, error, attempts): called once a dose is given up on
+    - on_outcome(outcome, latency): called for every "sent" / "retried" / "dead"
+      attempt outcome (latency in seconds for "sent", else None), e.g. for metrics
+    """
+
+    def __init__(self, send, dead_letter=None, workers=SEND_WORKERS,
+                 rate=SEND_RATE_PER_SECOND, burst=SEND_BURST, max_attempts=SEND_MAX_ATTEMPTS,
+                 on_outcome=None):
+        self.send = send
+        self.dead_letter = dead_letter
+        self.on_outcome = on_outcome
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate, burst)
+        self.stats = LatencyStats()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="whatsapp")
+
+    def submit(self, dose, scheduled_for):
+        """Queue one dose; scheduled_for is when it should have gone out (latency baseline)."""
+        self._executor.submit(self._attempt, dose, scheduled_for, 1)
+
+    def submit_batch(self, doses, scheduled_for):
+        for dose in doses:
+            self.submit(dose, scheduled_for)
+
+    def _record(self, scheduled_for, outcome, latency=None):
+        self.stats.record(scheduled_for, outcome, latency)
+        if self.on_outcome is not None:
+            try:
+                self.on_outcome(outcome, latency)
+            except Exception as e:
+                print(f"⚠️ Outcome hook failed: {e}")
+
+    def _attempt(self, dose, scheduled_for, attempt):
+        self.bucket.acquire()
+        try:
+            self.send(dose)
+        except Exception as e:
+            if attempt < self.max_attempts and is_retryable(e):
+                delay = backoff_delay(attempt)
+                print(f"🔁 Retrying reminder for {dose['name']} to {dose['to']} in {delay:.1f}s "
+                      f"(attempt {attempt}/{self.max_attempts}): {e}")
+                self._record(scheduled_for, "retried")
+                # Wait on a timer rather than in the pool so retries never block fresh sends
+                timer = threading.Timer(delay, self._executor.submit,
+                                        args=(self._attempt, dose, scheduled_for, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+            print(f"❌ Giving up on reminder for {dose['name']} to {dose['to']} after {attempt} attempts: {e}")
+            self._record(scheduled_for, "dead")
+            if self.dead_letter is not None:
+                try:
+                    self.dead_letter(dose, str(e), attempt)
+                except Exception as dl_error:
+                    print(f"❌ Could not record dead letter: {dl_error}")
+            return
+
+        latency = (datetime.now() - scheduled_for).total_seconds()
+        self._record(scheduled_for, "sent", latency)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,151 @@
+"""
+Minute-bucketed timing wheel for daily dose reminders.
+
+Every dose recurs daily at a fixed minute of the day, so the wheel has one slot
+per minute (1440). Insert and cancel are O(1) dict operations; firing a minute
+hands its whole bucket to the sender as one batch. This replaces one APScheduler
+cron job per user x medicine x time.
+"""
+import threading
+from datetime import datetime, timedelta
+
+SLOTS = 24 * 60
+
+
+def minute_of_day(hhmm, lead_minutes=0):
+    """'HH:MM' -> wheel slot, shifted earlier by lead_minutes (wrapping past midnight)."""
+    hour, minute = map(int, hhmm.split(":"))
+    return (hour * 60 + minute - lead_minutes) % SLOTS
+
+
+class DoseWheel:
+    """
+    1440 minute slots, each a dict of dose key -> dose.
+    A dose is a plain dict; it must carry "user_id" so a user's doses can be
+    cancelled together.
+    """
+
+    def __init__(self):
+        self._slots = [dict() for _ in range(SLOTS)]
+        self._slot_of = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, slot, dose):
+        """Insert (or move) a dose into a slot. O(1)."""
+        with self._lock:
+            old = self._slot_of.get(key)
+            if old is not None:
+                self._slots[old].pop(key, None)
+            self._slots[slot][key] = dose
+            self._slot_of[key] = slot
+            self._by_user.setdefault(dose["user_id"], set()).add(key)
+
+    def cancel(self, key):
+        """Remove one dose. O(1). Returns True if it was scheduled."""
+        with self._lock:
+            return self._cancel(key)
+
+    def _cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        dose = self._slots[slot].pop(key)
+        keys = self._by_user.get(dose["user_id"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[dose["user_id"]]
+        return True
+
+    def cancel_user(self, user_id):
+        """Remove every dose of a user. O(doses of that user)."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._cancel(key)
+
+    def due(self, slot):
+        """Snapshot of the doses in a slot."""
+        with self._lock:
+            return list(self._slots[slot].values())
+
+    def user_keys(self, user_id):
+        with self._lock:
+            return set(self._by_user.get(user_id, ()))
+
+    def __len__(self):
+        return len(self._slot_of)
+
+
+class DoseDispatcher:
+    """
+    Fires the wheel once per minute.
+    - tick() is driven by a single scheduler job; minutes missed because a tick
+      ran late are fired on the next tick, so slow ticks never drop a bucket.
+    - send_batch(doses, fire_time) receives every dose due that minute at once.
+    - lead_minutes: doses sit in the slot this many minutes before their time;
+      their course dates are checked against the actual dose date.
+    - max_catch_up_minutes: at most this many missed minutes are replayed
+      after a stall or restart; older ones are skipped.
+    - on_fired(minute): called after each minute is fired (e.g. to persist progress).
+    """
+
+    # Never replay more than this many minutes after a stall
+    MAX_CATCH_UP_MINUTES = 10
+
+    def __init__(self, wheel, send_batch, lead_minutes=1, max_catch_up_minutes=MAX_CATCH_UP_MINUTES,
+                 on_fired=None):
+        self.wheel = wheel
+        self.send_batch = send_batch
+        self.lead_minutes = lead_minutes
+        self.max_catch_up_minutes = max_catch_up_minutes
+        self.on_fired = on_fired
+        self.last_fired = None
+        self._lock = threading.Lock()
+
+    def doses_for(self, fire_time, only=None):
+        """Doses in fire_time's slot whose course covers the dose's own date (and match `only`)."""
+        dose_date = (fire_time + timedelta(minutes=self.lead_minutes)).date()
+        slot = fire_time.hour * 60 + fire_time.minute
+        return [
+            d for d in self.wheel.due(slot)
+            if d["start_date"] <= dose_date <= d["end_date"] and (only is None or only(d))
+        ]
+
+    def fire(self, fire_time, only=None):
+        doses = self.doses_for(fire_time, only)
+        if doses:
+            self.send_batch(doses, fire_time)
+        return len(doses)
+
+    def replay(self, since, until, only=None):
+        """
+        Fire the minutes after `since` up to `until` for the doses matching `only`,
+        within max_catch_up_minutes of `until` (e.g. shards taken over from a dead worker).
+        """
+        since = since.replace(second=0, microsecond=0)
+        until = until.replace(second=0, microsecond=0)
+        gap = min(int((until - since).total_seconds() // 60), self.max_catch_up_minutes + 1)
+        with self._lock:
+            return sum(self.fire(until - timedelta(minutes=i), only) for i in range(gap - 1, -1, -1))
+
+    def tick(self, now=None):
+        """Fire every minute bucket between the last tick and now. Returns doses fired."""
+        now = (now or datetime.now()).replace(second=0, microsecond=0)
+        with self._lock:
+            if self.last_fired is None:
+                minutes = [now]
+            elif now <= self.last_fired:
+                # Already fired (duplicate tick or clock stepped back)
+                minutes = []
+            else:
+                gap = int((now - self.last_fired).total_seconds() // 60)
+                gap = min(gap, max(1, self.max_catch_up_minutes + 1))
+                minutes = [now - timedelta(minutes=i) for i in range(gap - 1, -1, -1)]
+            fired = 0
+            for minute in minutes:
+                fired += self.fire(minute)
+                self.last_fired = minute
+            if minutes and self.on_fired is not None:
+                self.on_fired(self.last_fired)
+            return fired
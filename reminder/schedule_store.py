@@ -0,0 +1,91 @@
+"""
+Durable reminder scheduling state in MongoDB.
+
+- reminder_doses: one document per scheduled daily dose (the wheel's contents)
+- reminder_state: per-user fingerprint of the medicines the doses were built from
+- reminder_meta:  per-worker dispatcher progress (last fired minute) and the
+                  change-stream resume token / polling watermark
+
+Doses and state carry the user's shard, so a worker loads only the shards it
+holds (see sharding.py).
+
+On restart the service reloads the wheel and fingerprints with two cursor
+reads, resumes the change stream where it left off, and replays missed minutes
+according to the catch-up policy, instead of re-deriving everything from a full
+scan of the medicines collection.
+"""
+import json
+import hashlib
+from datetime import datetime, date
+
+from pymongo import DeleteMany, InsertOne
+
+
+def medicines_fingerprint(medicines):
+    """Stable hash of a user's medicines list (detects changes without keeping the list)."""
+    payload = json.dumps(medicines, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _as_datetime(value):
+    # BSON has no date-only type
+    return datetime.combine(value, datetime.min.time()) if isinstance(value, date) and not isinstance(value, datetime) else value
+
+
+class ScheduleStore:
+    """Persisted copy of the dose wheel plus the service's sync position."""
+
+    def __init__(self, db, meta_id="dispatcher"):
+        self.doses = db["reminder_doses"]
+        self.state = db["reminder_state"]
+        self.meta = db["reminder_meta"]
+        self.meta_id = meta_id
+
+    # ---- per-user schedule ----
+    @staticmethod
+    def _shard_query(shards):
+        return {} if shards is None else {"shard": {"$in": sorted(shards)}}
+
+    def load_fingerprints(self, shards=None):
+        query = self._shard_query(shards)
+        return {doc["_id"]: doc["fingerprint"] for doc in self.state.find(query, {"fingerprint": 1})}
+
+    def load_doses(self, shards=None):
+        """Yield (key, slot, dose) for every persisted dose (of the given shards)."""
+        for doc in self.doses.find(self._shard_query(shards)):
+            key = doc.pop("_id")
+            slot = doc.pop("slot")
+            doc.pop("shard", None)
+            doc["start_date"] = _as_date(doc["start_date"])
+            doc["end_date"] = _as_date(doc["end_date"])
+            yield key, slot, doc
+
+    def save_user(self, user_id, fingerprint, doses, shard=None):
+        """Replace a user's persisted doses. doses: [(key, slot, dose)]"""
+        ops = [DeleteMany({"user_id": user_id})]
+        for key, slot, dose in doses:
+            doc = dict(dose, _id=key, slot=slot, shard=shard)
+            doc["start_date"] = _as_datetime(doc["start_date"])
+            doc["end_date"] = _as_datetime(doc["end_date"])
+            ops.append(InsertOne(doc))
+        self.doses.bulk_write(ops, ordered=True)
+        self.state.update_one(
+            {"_id": user_id},
+            {"$set": {"fingerprint": fingerprint, "shard": shard, "updated_at": datetime.now()}},
+            upsert=True
+        )
+
+    def delete_user(self, user_id):
+        self.doses.delete_many({"user_id": user_id})
+        self.state.delete_one({"_id": user_id})
+
+    # ---- dispatcher progress / change-stream position ----
+    def get_meta(self):
+        return self.meta.find_one({"_id": self.meta_id}) or {}
+
+    def set_meta(self, **fields):
+        self.meta.update_one({"_id": self.meta_id}, {"$set": fields}, upsert=True)
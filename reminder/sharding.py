@@ -0,0 +1,230 @@
+"""
+Horizontal scaling for the reminder service.
+
+Users are split into REMINDER_SHARDS shards by a stable hash of their id. Each
+worker process claims a fair share of shards through leases in Mongo
+(reminder_leases) and only schedules and fires doses for users in the shards it
+holds. Leases are renewed every REMINDER_LEASE_SECONDS / 3; when a worker dies
+its leases expire and the remaining workers take the shards over.
+
+Every send is guarded by an idempotency key in reminder_sent
+(_id = "<dose key>:<dose date>"), so a dose that two workers both consider
+theirs during a hand-off still goes out once.
+"""
+import os
+import math
+import time
+import zlib
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+REMINDER_SHARDS = int(os.getenv("REMINDER_SHARDS", "16"))
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "30"))
+# Optional fixed worker id; by default each process claims "<host>-<n>" (see claim_worker_id)
+REMINDER_WORKER_ID = os.getenv("REMINDER_WORKER_ID")
+
+DUPLICATE_KEY = 11000
+
+
+def shard_of(user_id, shards=REMINDER_SHARDS):
+    """Shard of a user. crc32, not hash(): it must agree across processes and restarts."""
+    return zlib.crc32(str(user_id).encode("utf-8")) % shards
+
+
+def dose_key(dose):
+    return f"{dose['user_id']}_{dose['name']}_{dose['time']}"
+
+
+def _claim_worker(workers, worker_id, lease_seconds):
+    """Register worker_id unless a live process holds it. Returns True on success."""
+    now = datetime.now()
+    try:
+        workers.find_one_and_update(
+            {"_id": worker_id, "expires_at": {"$lt": now}},
+            {"$set": {"expires_at": now + timedelta(seconds=lease_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def claim_worker_id(db, worker_id=REMINDER_WORKER_ID, lease_seconds=REMINDER_LEASE_SECONDS):
+    """
+    A worker id no other live process uses, registered in reminder_workers.
+    - worker_id given: waits up to two lease periods for a crashed predecessor's
+      registration to expire, then refuses to start (RuntimeError) rather than
+      share the id with a running process.
+    - otherwise: the first free "<hostname>-<n>". Several processes on one host get
+      distinct ids, and a worker restarted after a clean stop gets its id (and so its
+      leases and sync position) back.
+    """
+    workers = db["reminder_workers"]
+    if worker_id:
+        deadline = time.time() + 2 * lease_seconds
+        while not _claim_worker(workers, worker_id, lease_seconds):
+            if time.time() >= deadline:
+                raise RuntimeError(f"Worker id {worker_id} is used by another live reminder process; "
+                                   f"give every process its own REMINDER_WORKER_ID")
+            time.sleep(1)
+        return worker_id
+
+    host = socket.gethostname()
+    slot = 0
+    while not _claim_worker(workers, f"{host}-{slot}", lease_seconds):
+        slot += 1
+    return f"{host}-{slot}"
+
+
+class LeaseManager:
+    """
+    Claims and renews shard leases for one worker (worker_id from claim_worker_id).
+    - on_gain(shards, takeovers): called with newly held shards; takeovers maps the
+      shards that were last held by another worker to that worker's last fired minute
+    - on_lose(shards): called before shards are given up (or after they were lost)
+    """
+
+    def __init__(self, db, worker_id, shards=REMINDER_SHARDS,
+                 lease_seconds=REMINDER_LEASE_SECONDS, on_gain=None, on_lose=None):
+        self.leases = db["reminder_leases"]
+        self.workers = db["reminder_workers"]
+        self.worker_id = worker_id
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.on_gain = on_gain
+        self.on_lose = on_lose
+        self.owned = set()
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+    def owns(self, shard):
+        return shard in self.owned
+
+    def owns_user(self, user_id):
+        return shard_of(user_id, self.shards) in self.owned
+
+    def _live_workers(self, now):
+        self.workers.update_one(
+            {"_id": self.worker_id},
+            {"$set": {"expires_at": now + timedelta(seconds=self.lease_seconds)}},
+            upsert=True
+        )
+        return max(1, self.workers.count_documents({"expires_at": {"$gt": now}}))
+
+    def _claim(self, shard, now):
+        """Take or renew one lease. Returns the lease as it was before, or None if held elsewhere."""
+        try:
+            return self.leases.find_one_and_update(
+                {"_id": shard, "$or": [{"owner": self.worker_id}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.worker_id, "expires_at": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            ) or {}
+        except DuplicateKeyError:
+            # The lease exists and someone else holds it
+            return None
+
+    def _release(self, shards):
+        # Only expire the lease: owner stays, so the next holder can tell whether it is
+        # taking the shard over from someone else or just getting its own shard back
+        if shards:
+            self.leases.update_many(
+                {"_id": {"$in": sorted(shards)}, "owner": self.worker_id},
+                {"$set": {"expires_at": datetime.min}}
+            )
+
+    def rebalance(self):
+        """One renewal round: renew held leases, give up extras, claim free shards up to a fair share."""
+        with self._lock:
+            now = datetime.now()
+            target = math.ceil(self.shards / self._live_workers(now))
+
+            # Renew; a lease that was taken over while we stalled is lost
+            lost = {s for s in self.owned if self._claim(s, now) is None}
+            if lost:
+                self.owned -= lost
+                print(f"⚠️ Lost shard leases {sorted(lost)}")
+                self._notify_lose(lost)
+
+            # Hand extras back so newly started workers can pick them up
+            extra = set(sorted(self.owned)[target:])
+            if extra:
+                self._notify_lose(extra)
+                self._release(extra)
+                self.owned -= extra
+                print(f"↪️ Released shards {sorted(extra)} (fair share is {target})")
+
+            gained, takeovers = set(), {}
+            for shard in range(self.shards):
+                if len(self.owned) + len(gained) >= target:
+                    break
+                if shard in self.owned:
+                    continue
+                before = self._claim(shard, now)
+                if before is None:
+                    continue
+                gained.add(shard)
+                # A shard this worker held last (e.g. before a clean restart) is not a takeover
+                if before.get("owner") != self.worker_id and before.get("last_fired") is not None:
+                    takeovers[shard] = before["last_fired"]
+            if gained:
+                self.owned |= gained
+                print(f"🔑 Worker {self.worker_id} acquired shards {sorted(gained)} ({len(self.owned)}/{self.shards} held)")
+                if self.on_gain is not None:
+                    self.on_gain(gained, takeovers)
+
+    def _notify_lose(self, shards):
+        if self.on_lose is not None:
+            self.on_lose(shards)
+
+    def record_progress(self, minute):
+        """Store the last fired minute on every held lease, for whoever takes a shard over."""
+        self.leases.update_many({"owner": self.worker_id, "expires_at": {"$gt": datetime.now()}},
+                                {"$set": {"last_fired": minute}})
+
+    def run(self):
+        """Renewal loop; run it on a daemon thread."""
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.rebalance()
+            except Exception as e:
+                print(f"⚠️ Lease renewal failed: {e}")
+
+    def stop(self):
+        """Stop renewing and hand every shard back immediately."""
+        self._stop.set()
+        with self._lock:
+            self._notify_lose(set(self.owned))
+            self._release(self.owned)
+            self.workers.delete_one({"_id": self.worker_id})
+            self.owned = set()
+
+
+class SentLog:
+    """Idempotency keys for sent reminders, one per dose per day."""
+
+    def __init__(self, db):
+        self.sent = db["reminder_sent"]
+
+    def claim(self, doses, dose_date):
+        """Record doses as sent; returns only the ones no worker has claimed yet."""
+        if not doses:
+            return []
+        now = datetime.now()
+        day = dose_date.isoformat()
+        try:
+            self.sent.insert_many(
+                [{"_id": f"{dose_key(d)}:{day}", "user_id": d["user_id"], "sent_at": now} for d in doses],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err["code"] != DUPLICATE_KEY for err in errors):
+                raise
+            duplicates = {err["index"] for err in errors}
+            return [d for i, d in enumerate(doses) if i not in duplicates]
+        return list(doses)
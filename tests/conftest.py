@@ -0,0 +1,35 @@
+"""
+Shared set-up: the backend's utils are importable, and every MongoClient is one
+in-memory mongomock client (patched before mongo_conn is first imported).
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "Backend", "app", "utils"))
+
+
+def _use_mongomock():
+    import pymongo
+    import mongomock
+    import mongomock.gridfs
+
+    mongomock.gridfs.enable_gridfs_integration()
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+
+
+_use_mongomock()
+
+
+@pytest.fixture
+def db_utils():
+    """utils/db_utils.py with empty collections and its indexes in place."""
+    import db_utils
+
+    for name in db_utils.db.list_collection_names():
+        db_utils.db.drop_collection(name)
+    db_utils.ensure_indexes()
+    return db_utils
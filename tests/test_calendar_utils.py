@@ -0,0 +1,145 @@
+import os
+import json
+import threading
+
+import httplib2
+import pytest
+import googleapiclient
+from googleapiclient.errors import HttpError
+from google.oauth2.credentials import Credentials
+
+import calendar_utils
+
+EMAIL = "calendar@example.com"
+
+
+def http_error(status, reason):
+    content = json.dumps({"error": {"code": status, "errors": [{"reason": reason}]}}).encode()
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.executes += 1
+        self.service.batch_sizes.append(len(self.requests))
+        for request_id, request in self.requests:
+            response, error = self.service.respond(request["body"])
+            self.callback(request_id, response, error)
+
+
+class FakeService:
+    """Just the calendar service surface add_medicine_events uses; counts batch round trips."""
+
+    def __init__(self, failures=None):
+        # summary -> errors returned for its first attempts, in order
+        self.failures = {summary: list(errors) for summary, errors in (failures or {}).items()}
+        self.executes = 0
+        self.batch_sizes = []
+        self.attempts = {}
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return {"calendarId": calendarId, "body": body}
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def respond(self, body):
+        summary = body["summary"]
+        self.attempts[summary] = self.attempts.get(summary, 0) + 1
+        pending = self.failures.get(summary)
+        if pending:
+            return None, pending.pop(0)
+        return {"htmlLink": f"https://calendar.example/{summary}"}, None
+
+
+def medicines(count):
+    return [{"name": f"Med{i}", "time": ["08:00"], "start_date": "2025-01-01", "end_date": "2025-01-07",
+             "notes": ""} for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(calendar_utils.time, "sleep", lambda seconds: None)
+
+
+def test_inserts_go_out_in_batches_of_fifty():
+    service = FakeService()
+
+    links = calendar_utils.add_medicine_events(service, medicines(120), EMAIL)
+
+    assert service.executes == 3  # ceil(120 / 50)
+    assert service.batch_sizes == [50, 50, 20]
+    assert len(links) == 120
+    assert set(service.attempts.values()) == {1}
+
+
+def test_only_rate_limited_calls_are_retried():
+    limited = {"Take Med3": [http_error(429, "rateLimitExceeded")],
+               "Take Med77": [http_error(403, "userRateLimitExceeded"), http_error(429, "rateLimitExceeded")]}
+    service = FakeService(dict(limited, **{"Take Med9": [http_error(403, "forbidden")]}))
+
+    links = calendar_utils.add_medicine_events(service, medicines(120), EMAIL)
+
+    # 3 batches, then one retry batch per round for what was still rate limited
+    assert service.executes == 5
+    assert service.batch_sizes[3:] == [2, 1]
+    assert service.attempts["Take Med3"] == 2
+    assert service.attempts["Take Med77"] == 3
+    # A non-rate-limit error is not retried, and its event is left out of the links
+    assert service.attempts["Take Med9"] == 1
+    assert all(count == 1 for summary, count in service.attempts.items()
+               if summary not in limited)
+    assert len(links) == 119
+    assert "https://calendar.example/Take Med9" not in links
+
+
+def test_rate_limit_gives_up_after_max_retries():
+    errors = [http_error(429, "rateLimitExceeded")] * (calendar_utils.MAX_RETRIES + 1)
+    service = FakeService({"Take Med0": errors})
+
+    links = calendar_utils.add_medicine_events(service, medicines(1), EMAIL)
+
+    assert service.attempts["Take Med0"] == calendar_utils.MAX_RETRIES + 1
+    assert links == []
+
+
+def test_each_call_gets_its_own_service_but_credentials_are_loaded_once(monkeypatch):
+    # The client library ships a copy of the Calendar v3 discovery document
+    path = os.path.join(os.path.dirname(googleapiclient.__file__), "discovery_cache", "documents", "calendar.v3.json")
+    with open(path) as f:
+        monkeypatch.setattr(calendar_utils, "_discovery_doc", f.read())
+    monkeypatch.setattr(calendar_utils, "_credentials", calendar_utils.OrderedDict())
+    loads = []
+
+    def load_credentials(email, interactive=True):
+        loads.append(email)
+        return Credentials(token="token")
+
+    monkeypatch.setattr(calendar_utils, "load_credentials", load_credentials)
+
+    services = []
+    threads = [threading.Thread(target=lambda: services.append(calendar_utils.authenticate_google(EMAIL)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    services.append(calendar_utils.authenticate_google(EMAIL))
+
+    # httplib2.Http is not thread-safe: no two services may share one
+    assert len({id(service._http) for service in services}) == len(services) == 5
+    assert 1 <= len(loads) <= 4  # concurrent first calls may each load; later ones hit the cache
+    loads.clear()
+    calendar_utils.authenticate_google(EMAIL)
+    assert loads == []
@@ -0,0 +1,113 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+WRITERS = 50
+EMAIL = "concurrent@example.com"
+
+
+@pytest.fixture(autouse=True)
+def slow_reads(db_utils, monkeypatch):
+    """
+    Make every find_one yield before returning, so a read-modify-write writer
+    would reliably interleave with the others (and lose their entries).
+    """
+    for collection in (db_utils.prescriptions, db_utils.medicines_collection):
+        find_one = collection.find_one
+
+        def slow_find_one(*args, _find_one=find_one, **kwargs):
+            result = _find_one(*args, **kwargs)
+            time.sleep(0.01)
+            return result
+
+        monkeypatch.setattr(collection, "find_one", slow_find_one)
+
+
+def run_concurrently(fn, count=WRITERS):
+    """Call fn(i) for i in range(count) from count threads released at the same moment."""
+    barrier = threading.Barrier(count)
+
+    def call(i):
+        barrier.wait()
+        return fn(i)
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return list(pool.map(call, range(count)))
+
+
+def test_concurrent_save_medicines_keeps_every_entry(db_utils):
+    run_concurrently(lambda i: db_utils.save_medicines(EMAIL, [{
+        "name": f"Medicine {i}",
+        "time": ["08:00"],
+        "start_date": "2025-01-01",
+        "end_date": "2025-01-07",
+    }]))
+
+    docs = list(db_utils.medicines_collection.find({"email": EMAIL}))
+    assert len(docs) == 1
+    names = sorted(med["name"] for med in docs[0]["medicines"])
+    assert names == sorted(f"Medicine {i}" for i in range(WRITERS))
+
+
+def test_concurrent_save_prescription_keeps_every_entry(db_utils):
+    run_concurrently(lambda i: db_utils.save_prescription(EMAIL, {"medicines": []}, f"medicines_{i}.json"))
+
+    docs = list(db_utils.prescriptions.find({"email": EMAIL}))
+    assert len(docs) == 1
+    files = sorted(entry["file"] for entry in docs[0]["prescriptions"])
+    assert files == sorted(f"medicines_{i}.json" for i in range(WRITERS))
+
+
+def test_concurrent_save_prescription_to_db_keeps_every_entry(db_utils):
+    results = run_concurrently(
+        lambda i: db_utils.save_prescription_to_db(EMAIL, "Concurrent", {"medicines": []}, f"medicines_{i}.json"))
+
+    assert all(results)
+    doc = db_utils.prescriptions.find_one({"email": EMAIL})
+    assert doc["name"] == "Concurrent"
+    assert len(doc["prescriptions"]) == WRITERS
+
+
+def gridfs_ids(db_utils):
+    return {f._id for f in db_utils.fs.find({})}
+
+
+def test_delete_prescription_removes_image_and_derivatives(db_utils):
+    entry = db_utils.save_prescription(EMAIL, {"medicines": []}, "medicines_a.json", image_bytes=b"image")
+    for variant in ("thumb", "model"):
+        db_utils.fs.put(b"derivative", derived_from=entry["image_file_id"], variant=variant)
+
+    assert db_utils.delete_prescription(EMAIL, "medicines_a.json")
+
+    assert gridfs_ids(db_utils) == set()
+
+
+def test_delete_merged_prescription_removes_every_page(db_utils):
+    pages = [db_utils.build_prescription_entry(EMAIL, None, "medicines_m.json", f"page {i}".encode(), f"p{i}.jpg")
+             for i in range(3)]
+    for page in pages:
+        db_utils.fs.put(b"thumb", derived_from=page["image_file_id"], variant="thumb")
+    entry = dict(pages[0], data={"medicines": []}, pages=[
+        {k: p[k] for k in ("image_name", "image_file_id", "image_size", "image_sha256")} for p in pages
+    ])
+    db_utils.save_prescriptions_bulk(EMAIL, [entry])
+
+    assert db_utils.delete_prescription(EMAIL, "medicines_m.json")
+
+    assert gridfs_ids(db_utils) == set()
+
+
+def test_save_medicine_files_writes_a_batch_in_one_insert(db_utils, monkeypatch):
+    inserts = []
+    insert_many = db_utils.medicine_files.insert_many
+    monkeypatch.setattr(db_utils.medicine_files, "insert_many",
+                        lambda docs, **kwargs: inserts.append(len(docs)) or insert_many(docs, **kwargs))
+    datas = [{"medicines": [{"name": f"Medicine {i}"}]} for i in range(5)]
+
+    filenames = db_utils.save_medicine_files(EMAIL, datas)
+
+    assert inserts == [5]
+    assert [db_utils.get_medicine_file(name)["data"] for name in filenames] == datas
+    assert db_utils.delete_medicine_files(filenames) == 5
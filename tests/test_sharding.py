@@ -0,0 +1,96 @@
+import os
+import sys
+from datetime import date, datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reminder"))
+
+import sharding
+from sharding import LeaseManager, SentLog, claim_worker_id
+
+SHARDS = 16
+
+
+@pytest.fixture
+def db():
+    import mongomock
+
+    return mongomock.MongoClient().db
+
+
+def start_worker(db, worker_id=None, **kwargs):
+    return LeaseManager(db, claim_worker_id(db, worker_id), shards=SHARDS, **kwargs)
+
+
+def settle(workers, rounds=3):
+    for _ in range(rounds):
+        for worker in workers:
+            worker.rebalance()
+
+
+def test_processes_on_one_host_get_distinct_ids(db, monkeypatch):
+    monkeypatch.setattr(sharding.socket, "gethostname", lambda: "host")
+
+    ids = [claim_worker_id(db, None) for _ in range(3)]
+
+    assert ids == ["host-0", "host-1", "host-2"]
+
+
+def test_an_explicit_id_held_by_a_live_process_is_refused(db, monkeypatch):
+    claim_worker_id(db, "fixed")
+    monkeypatch.setattr(sharding.time, "sleep", lambda seconds: None)
+
+    with pytest.raises(RuntimeError):
+        claim_worker_id(db, "fixed", lease_seconds=0)
+
+
+def test_workers_hold_disjoint_shards_and_claim_each_dose_once(db):
+    workers = [start_worker(db) for _ in range(3)]
+    settle(workers)
+
+    owned = [w.owned for w in workers]
+    assert sum(len(o) for o in owned) == SHARDS
+    assert set().union(*owned) == set(range(SHARDS))
+    assert all(len(o) <= 6 for o in owned)  # fair share: ceil(16 / 3)
+
+    # Every worker fires the doses of the users it owns; each dose goes out exactly once
+    doses = [{"user_id": str(u), "name": "Paracetamol", "time": "08:00"} for u in range(200)]
+    log = SentLog(db)
+    claimed = []
+    for worker in workers:
+        mine = [d for d in doses if worker.owns_user(d["user_id"])]
+        claimed += log.claim(mine, date(2025, 1, 1))
+    assert sorted(d["user_id"] for d in claimed) == sorted(d["user_id"] for d in doses)
+
+    # Even if every worker tried every dose, each would still be claimed once
+    again = [log.claim(doses, date(2025, 1, 2)) for _ in workers]
+    assert sum(len(c) for c in again) == len(doses)
+
+
+def test_clean_restart_is_not_a_takeover(db, monkeypatch):
+    monkeypatch.setattr(sharding.socket, "gethostname", lambda: "host")
+    gained = []
+    worker = start_worker(db, on_gain=lambda shards, takeovers: gained.append((shards, takeovers)))
+    settle([worker], rounds=1)
+    worker.record_progress(datetime(2025, 1, 1, 8, 0))
+    worker.stop()
+
+    restarted = start_worker(db, on_gain=lambda shards, takeovers: gained.append((shards, takeovers)))
+    settle([restarted], rounds=1)
+
+    assert restarted.worker_id == worker.worker_id
+    assert gained[-1] == (set(range(SHARDS)), {})
+
+
+def test_shards_of_another_worker_are_takeovers(db):
+    first = start_worker(db, "A")
+    settle([first], rounds=1)
+    first.record_progress(datetime(2025, 1, 1, 8, 0))
+    first.stop()
+
+    gained = []
+    second = start_worker(db, "B", on_gain=lambda shards, takeovers: gained.append(takeovers))
+    settle([second], rounds=1)
+
+    assert gained[-1] == {shard: datetime(2025, 1, 1, 8, 0) for shard in range(SHARDS)}